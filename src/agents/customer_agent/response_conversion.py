@@ -83,14 +83,15 @@ async def convert_order(item: RAGOutputNodeItem, user_id: int) -> OrderComponent
         logger.warning(f"Agent halucinated Order {item.id}")
         return None
 
+    products = await db.get_many(
+        Product,
+        [line_item.product_id for line_item in order.line_items],
+        options=[selectinload(Product.producer)],
+    )
+
     items = []
     for line_item in order.line_items:
-        product = await db.query_table(
-            Product,
-            where_clauses=[Product.id == line_item.product_id],
-            mode="first",
-            options=[selectinload(Product.producer)],
-        )
+        product = products.get(line_item.product_id)
         if product is None:
             logger.warning(f"Product of {line_item.id} lineitem not found")
             continue
@@ -38,13 +38,13 @@ async def get_active_or_last_orders(tool_context: ToolContext) -> dict:
                 "currency",
             ]
         )
+        products = await db.get_many(
+            Product, [line_item.product_id for line_item in order.line_items]
+        )
+
         val["line_items"] = []
         for line_item in order.line_items:
-            product = await db.query_table(
-                Product,
-                where_clauses=[Product.id == line_item.product_id],
-                mode="first",
-            )
+            product = products.get(line_item.product_id)
 
             item = line_item.model_dump()
             if product:
@@ -1,7 +1,8 @@
 from loguru import logger
 from sqlalchemy.orm import selectinload
 
-from src.turri_data_hub.embedding import compute_embeddings
+from src.turri_data_hub.embedding import embed_query
+from src.turri_data_hub.settings import database_settings
 from src.turri_data_hub.woocommerce.models import Producer, Product
 
 from ...db import db
@@ -24,10 +25,13 @@ async def rag_fetch_producers(query: str) -> dict:
     logger.info(format_tool_args("rag_fetch_producers", query=query))
 
     try:
-        embeddings = await compute_embeddings([query])
+        query_embedding = await embed_query(query)
 
         producers: list[Producer] = await db.query_table(
-            Producer, order_by=[Producer.embedding.l2_distance(embeddings[0])], limit=5
+            Producer,
+            order_by=[Producer.embedding.l2_distance(query_embedding)],
+            limit=5,
+            ef_search=database_settings.rag_ef_search,
         )
         result = {
             "status": "success",
@@ -1,7 +1,8 @@
 from loguru import logger
 from sqlalchemy.orm import selectinload
 
-from src.turri_data_hub.embedding import compute_embeddings
+from src.turri_data_hub.embedding import embed_query
+from src.turri_data_hub.settings import database_settings
 from src.turri_data_hub.woocommerce.models import Product
 
 from ...db import db
@@ -24,17 +25,18 @@ async def rag_fetch_products(query: str) -> dict:
     logger.info(format_tool_args("rag_fetch_products", query=query))
 
     try:
-        embeddings = await compute_embeddings([query])
+        query_embedding = await embed_query(query)
 
         products: list[Product] = await db.query_table(
             Product,
             order_by=[
-                Product.embedding.l2_distance(embeddings[0]),
+                Product.embedding.l2_distance(query_embedding),
                 Product.catalog_visibility == "visible",
                 Product.status == "publish",
             ],
             limit=5,
             options=[selectinload(Product.categories), selectinload(Product.tags)],
+            ef_search=database_settings.rag_ef_search,
         )
 
         result = {"status": "success", "products": _products_to_dict(products)}
@@ -2,6 +2,7 @@ import json
 
 from google.adk.tools.tool_context import ToolContext
 from loguru import logger
+from sqlalchemy.orm import undefer
 
 from src.turri_data_hub.recommendation_system.get_recommendations import (
     get_top_k_producers,
@@ -162,7 +163,10 @@ async def get_personalized_product_recommendations_for_user(tool_context: ToolCo
 
     try:
         profile: UserBehavior = await db.query_table(
-            UserBehavior, where_clauses=[UserBehavior.user_id == user_id], mode="first"
+            UserBehavior,
+            where_clauses=[UserBehavior.user_id == user_id],
+            mode="first",
+            options=[undefer(UserBehavior.embedding)],
         )
 
         if not profile:
@@ -208,7 +212,10 @@ async def get_personalized_producer_recommendations_for_user(tool_context: ToolC
 
     try:
         profile: UserBehavior = await db.query_table(
-            UserBehavior, where_clauses=[UserBehavior.user_id == user_id], mode="first"
+            UserBehavior,
+            where_clauses=[UserBehavior.user_id == user_id],
+            mode="first",
+            options=[undefer(UserBehavior.embedding)],
         )
 
         if not profile:
@@ -31,7 +31,7 @@ async def get_customer_profiles(
             raise RuntimeError("state.producer_id must be set")
 
         profiles: list[UserBehavior] = await get_customer_profiles_of_producer(
-            db=db, producer_id=producer_id
+            db=db, producer_id=producer_id, with_embeddings=False
         )
 
         return {
@@ -1,9 +1,16 @@
 from datetime import datetime
+from typing import Awaitable, Callable
 
 from fastapi import APIRouter, HTTPException, Request
 from loguru import logger
 
 from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.embedding import embedding_service, query_embedding_cache
+from src.turri_data_hub.query_stats import global_query_stats
+from src.turri_data_hub.recommendation_system.precompute_recommendations import (
+    PRECOMPUTED_K,
+    precompute_recommendations,
+)
 from src.turri_data_hub.recommendation_system.update_analytics import (
     update_customer_profiles_based_on_analytics,
 )
@@ -14,86 +21,224 @@ from src.turri_data_hub.update.fetch_all_woocommerce import fetch_all_wocommerce
 from src.turri_data_hub.update.fetch_google_anylytics_data import (
     fetch_google_analytics_data,
 )
+from src.turri_data_hub.update.jobs import JobAlreadyRunning, job_runner
+from src.turri_data_hub.update.models import Job
+from src.turri_data_hub.update.webhooks import webhook_queue
+from src.turri_data_hub.woocommerce.fetch.utils import woocommerce_client
 
 admin_router = APIRouter(prefix="/admin", tags=["admin"])
 
 
-@admin_router.post("/fetch-woocommerce-data")
-async def fetch_woocommerce_data(request: Request):
+async def start_job(
+    request: Request,
+    name: str,
+    func: Callable[[], Awaitable[dict | None]],
+    params: dict | None = None,
+) -> dict:
     try:
-        await fetch_all_wocommerce_data()
+        db: TurriDB = request.app.state.db
+        job = await job_runner.start(db, name, func, params=params)
         return {
             "status": "success",
-            "message": "All WooCommerce data fetched and saved.",
+            "message": f"Started job '{name}', poll /admin/jobs/{job.id}.",
+            "job": job,
         }
+    except JobAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        logger.exception("Failed to fetch all WooCommerce data")
+        logger.exception(f"Failed to start job '{name}'")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
+def parse_from_date(from_date: str) -> datetime:
+    if not from_date:
+        raise HTTPException(
+            status_code=400, detail="from_date is required (YYYY-MM-DD)"
+        )
+    try:
+        return datetime.fromisoformat(from_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from_date must be YYYY-MM-DD")
+
+
+@admin_router.post("/fetch-woocommerce-data")
+async def fetch_woocommerce_data(
+    request: Request, full: bool | None = None, resume: bool = True
+):
+    """
+    Starts a background job syncing the shop incrementally. `full=true` forces a
+    full pass, `full=false` skips a scheduled one. An interrupted sync is resumed
+    unless `resume=false`.
+    """
+    return await start_job(
+        request,
+        "fetch-woocommerce-data",
+        lambda: fetch_all_wocommerce_data(full=full, resume=resume),
+        params={"full": full, "resume": resume},
+    )
+
+
 @admin_router.post("/fetch-bigquery-data")
 async def fetch_bigquery_data(request: Request):
-    try:
-        db: TurriDB = request.app.state.db
-        await fetch_google_analytics_data(db)
-        return {
-            "status": "success",
-            "message": "Google Analytics data fetched and saved.",
-        }
-    except Exception as e:
-        logger.exception("Failed to fetch Google Analytics data")
-        raise HTTPException(status_code=500, detail=f"Error: {e}")
+    """
+    Starts a background job fetching the Google Analytics data of all pages.
+    """
+    db: TurriDB = request.app.state.db
+    return await start_job(
+        request, "fetch-bigquery-data", lambda: fetch_google_analytics_data(db)
+    )
+
+
+async def _profiles_result(update: Awaitable[tuple[int, int]]) -> dict:
+    success, failures = await update
+    return {"success": success, "failures": failures}
 
 
 @admin_router.post("/update-customer-profiles-woocommerce")
 async def update_customer_profiles_no_body(request: Request, from_date: str):
     """
-    Updates customer profiles based on WooCommerce orders since a given date.
+    Starts a background job updating customer profiles based on WooCommerce orders
+    since a given date.
     Expects a query parameter: from_date=YYYY-MM-DD
     """
+    from_date_dt = parse_from_date(from_date)
+    db: TurriDB = request.app.state.db
+    return await start_job(
+        request,
+        "update-customer-profiles-woocommerce",
+        lambda: _profiles_result(
+            update_customer_profiles_based_on_orders(db, from_date_dt)
+        ),
+        params={"from_date": from_date},
+    )
+
+
+@admin_router.post("/update-customer-profiles-analytics")
+async def update_customer_profiles_analytics(request: Request, from_date: str):
+    """
+    Starts a background job updating customer profiles based on Google Analytics
+    data since a given date.
+    Expects a query parameter: from_date=YYYY-MM-DD
+    """
+    from_date_dt = parse_from_date(from_date)
+    db: TurriDB = request.app.state.db
+    return await start_job(
+        request,
+        "update-customer-profiles-analytics",
+        lambda: _profiles_result(
+            update_customer_profiles_based_on_analytics(db, from_date_dt)
+        ),
+        params={"from_date": from_date},
+    )
+
+
+@admin_router.get("/jobs")
+async def list_jobs(request: Request, name: str | None = None, limit: int = 20):
+    """
+    Returns the most recently started jobs, optionally only those of one name.
+    """
+    db: TurriDB = request.app.state.db
+    return await db.query_table(
+        Job,
+        where_clauses=[Job.name == name] if name else None,
+        order_by=[Job.started_at.desc()],
+        limit=limit,
+    )
+
+
+@admin_router.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str) -> Job:
+    """
+    Returns the status, progress, errors and, once finished, result of a job.
+    """
+    db: TurriDB = request.app.state.db
+    job = await db.query_table(Job, where_clauses=[Job.id == job_id], mode="first")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@admin_router.post("/precompute-recommendations")
+async def precompute_recommendations_endpoint(request: Request, k: int = PRECOMPUTED_K):
+    """
+    Starts a background job computing and storing the top-k product and producer
+    recommendations of every onboarded user. The customer recommendation
+    endpoints serve them for requests with the same k.
+    """
+    db: TurriDB = request.app.state.db
+
+    async def run() -> dict:
+        return {"users": await precompute_recommendations(db, k=k)}
+
+    return await start_job(request, "precompute-recommendations", run, params={"k": k})
+
+
+@admin_router.post("/create-vector-indexes")
+async def create_vector_indexes(request: Request):
+    """
+    Creates the HNSW indexes missing on existing tables, e.g. after an embedding
+    column got one. Run it once per deployment that adds an index.
+    """
     try:
-        if not from_date:
-            raise HTTPException(
-                status_code=400, detail="from_date is required (YYYY-MM-DD)"
-            )
-        from_date_dt = datetime.fromisoformat(from_date)
         db: TurriDB = request.app.state.db
-        success, failures = await update_customer_profiles_based_on_orders(
-            db, from_date_dt
-        )
+        created = await db.create_vector_indexes()
         return {
             "status": "success",
-            "message": f"Customer profiles updated. Success: {success}, Failures: {failures}",
-            "success": success,
-            "failures": failures,
+            "message": f"Created {len(created)} vector indexes.",
+            "indexes": created,
         }
     except Exception as e:
-        logger.exception("Failed to update customer profiles")
+        logger.exception("Failed to create vector indexes")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
-@admin_router.post("/update-customer-profiles-analytics")
-async def update_customer_profiles_analytics(request: Request, from_date: str):
+@admin_router.post("/rebuild-vector-indexes")
+async def rebuild_vector_indexes(request: Request):
     """
-    Updates customer profiles based on Google Analytics data since a given date.
-    Expects a query parameter: from_date=YYYY-MM-DD
+    Rebuilds the HNSW indexes of all embedding columns.
     """
     try:
-        if not from_date:
-            raise HTTPException(
-                status_code=400, detail="from_date is required (YYYY-MM-DD)"
-            )
-        from_date_dt = datetime.fromisoformat(from_date)
         db: TurriDB = request.app.state.db
-        success, failures = await update_customer_profiles_based_on_analytics(
-            db, from_date_dt
-        )
+        rebuilt = await db.rebuild_vector_indexes()
         return {
             "status": "success",
-            "message": f"Customer profiles updated from analytics. Success: {success}, Failures: {failures}",
-            "success": success,
-            "failures": failures,
+            "message": f"Rebuilt {len(rebuilt)} vector indexes.",
+            "indexes": rebuilt,
         }
     except Exception as e:
-        logger.exception("Failed to update customer profiles from analytics")
+        logger.exception("Failed to rebuild vector indexes")
         raise HTTPException(status_code=500, detail=f"Error: {e}")
+
+
+@admin_router.get("/db-stats")
+async def db_stats(top: int = 20):
+    """
+    Returns the database call statistics collected since the process started.
+    """
+    return global_query_stats.summary(top=top)
+
+
+@admin_router.get("/embedding-stats")
+async def embedding_stats():
+    """
+    Returns the hit and miss counts of the embedding cache table and the query
+    embedding cache since the process started.
+    """
+    return {**embedding_service.stats(), "query_cache": query_embedding_cache.stats()}
+
+
+@admin_router.get("/woocommerce-stats")
+async def woocommerce_stats():
+    """
+    Returns the request, retry and throttling counts of the WooCommerce client and
+    its current concurrency limit.
+    """
+    return woocommerce_client.stats()
+
+
+@admin_router.get("/webhook-stats")
+async def webhook_stats():
+    """
+    Returns the received, applied and failed webhook counts since the process started.
+    """
+    return webhook_queue.stats()
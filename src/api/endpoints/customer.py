@@ -3,6 +3,7 @@ from uuid import uuid4
 
 from fastapi import APIRouter, HTTPException, Request
 from loguru import logger
+from sqlalchemy.orm import undefer
 
 from src.agents.customer_agent.main import (
     get_normal_conversation_response,
@@ -14,9 +15,13 @@ from src.turri_data_hub.recommendation_system.get_recommendations import (
     get_top_k_products,
 )
 from src.turri_data_hub.recommendation_system.models import UserBehavior
+from src.turri_data_hub.recommendation_system.precompute_recommendations import (
+    get_precomputed_recommendations,
+)
 from src.turri_data_hub.recommendation_system.process_onboarding import (
     process_onboarding,
 )
+from src.turri_data_hub.woocommerce.models import Producer, Product
 
 from ..models import (
     ChatAnswer,
@@ -132,14 +137,20 @@ async def customer_product_recommendations(
 ) -> list[ProductComponent]:
     """
     Returns top-k product recommendations for a customer.
+    Serves the precomputed recommendations if available, live ones otherwise.
     """
     db: TurriDB = request.app.state.db
-    behaviour: UserBehavior = await db.query_table(
-        UserBehavior, where_clauses=[UserBehavior.user_id == user_id], mode="first"
-    )
-    if not behaviour or not behaviour.is_onboarded:
-        raise HTTPException(404, "User not onboarded or not found")
-    products = await get_top_k_products(db, behaviour, k)
+    products = await get_precomputed_recommendations(db, user_id, Product, k)
+    if products is None:
+        behaviour: UserBehavior = await db.query_table(
+            UserBehavior,
+            where_clauses=[UserBehavior.user_id == user_id],
+            mode="first",
+            options=[undefer(UserBehavior.embedding)],
+        )
+        if not behaviour or not behaviour.is_onboarded:
+            raise HTTPException(404, "User not onboarded or not found")
+        products = await get_top_k_products(db, behaviour, k)
     return [
         ProductComponent(
             product_id=p.id,
@@ -162,14 +173,20 @@ async def customer_producer_recommendations(
 ) -> list[ProducerComponent]:
     """
     Returns top-k producer recommendations for a customer.
+    Serves the precomputed recommendations if available, live ones otherwise.
     """
     db: TurriDB = request.app.state.db
-    behaviour: UserBehavior = await db.query_table(
-        UserBehavior, where_clauses=[UserBehavior.user_id == user_id], mode="first"
-    )
-    if not behaviour or not behaviour.is_onboarded:
-        raise HTTPException(404, "User not onboarded or not found")
-    producers = await get_top_k_producers(db, behaviour, k)
+    producers = await get_precomputed_recommendations(db, user_id, Producer, k)
+    if producers is None:
+        behaviour: UserBehavior = await db.query_table(
+            UserBehavior,
+            where_clauses=[UserBehavior.user_id == user_id],
+            mode="first",
+            options=[undefer(UserBehavior.embedding)],
+        )
+        if not behaviour or not behaviour.is_onboarded:
+            raise HTTPException(404, "User not onboarded or not found")
+        producers = await get_top_k_producers(db, behaviour, k)
     return [
         ProducerComponent(
             producer_id=p.id,
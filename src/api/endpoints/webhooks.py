@@ -0,0 +1,56 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from fastapi import APIRouter, HTTPException, Request
+from loguru import logger
+
+from src.turri_data_hub.update.webhooks import (
+    parse_topic,
+    verify_signature,
+    webhook_queue,
+)
+from src.turri_data_hub.woocommerce.fetch.utils import woocommerce_client
+
+webhook_router = APIRouter(
+    prefix="/webhooks",
+    tags=["webhooks"],
+)
+
+
+@webhook_router.post("/woocommerce")
+async def woocommerce_webhook(request: Request):
+    """
+    Receives the shop's product, order and customer webhooks and queues them to
+    be applied in the background, see `WebhookQueue`.
+    """
+    body = await request.body()
+    topic = request.headers.get("X-WC-Webhook-Topic")
+    if topic is None and "webhook_id" in parse_qs(body.decode(errors="replace")):
+        # sent once, unsigned, when the webhook is created in the shop
+        return {"status": "success", "message": "Ping received."}
+
+    secret = woocommerce_client.settings.WOOCOMMERCE_WEBHOOK_SECRET
+    if not secret:
+        raise HTTPException(status_code=503, detail="Webhooks are not configured")
+    if not verify_signature(
+        body, request.headers.get("X-WC-Webhook-Signature"), secret
+    ):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    if topic is None:
+        raise HTTPException(status_code=400, detail="Missing X-WC-Webhook-Topic")
+    parsed = parse_topic(topic)
+    if parsed is None:
+        logger.debug(f"Ignoring webhook topic '{topic}'")
+        return {"status": "ignored", "message": f"Unhandled topic '{topic}'."}
+
+    try:
+        data = json.loads(body)
+        webhook_queue.enqueue(parsed, data)
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    except (asyncio.QueueFull, RuntimeError) as e:
+        logger.warning(f"Rejecting {topic} webhook: {type(e).__name__} {e}")
+        raise HTTPException(status_code=503, detail="Webhook backlog is full")
+    return {"status": "success", "message": f"Queued {topic} webhook."}
@@ -7,9 +7,17 @@ from loguru import logger
 from src.api.endpoints.admin import admin_router
 from src.api.endpoints.customer import customer_router
 from src.api.endpoints.producer import producer_router
+from src.api.endpoints.webhooks import webhook_router
 from src.api.rate_limiter import RateLimiter
 from src.api.settings import ratelimiter_settings
 from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.query_stats import query_scope
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    recommendation_index,
+)
+from src.turri_data_hub.update.jobs import job_runner
+from src.turri_data_hub.update.webhooks import webhook_queue
+from src.turri_data_hub.woocommerce.fetch.utils import woocommerce_client
 from dotenv import load_dotenv
 import os
 
@@ -33,8 +41,17 @@ async def lifespan(app: FastAPI):
     app.state.db = TurriDB()
     assert await app.state.db.check_health()
     await app.state.db.initialize_db()
+    try:
+        await recommendation_index.load(app.state.db)
+    except Exception:
+        # recommendations fall back to SQL while the index is cold
+        logger.exception("Failed to load the recommendation index")
+    webhook_queue.start(app.state.db)
     yield
 
+    await webhook_queue.stop()
+    await job_runner.stop()
+    await woocommerce_client.aclose()
     logger.info("Application shutdown complete.")
 
 
@@ -42,6 +59,7 @@ app = FastAPI(lifespan=lifespan)
 app.include_router(customer_router)
 app.include_router(producer_router)
 app.include_router(admin_router)
+app.include_router(webhook_router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Change to your domains in production
@@ -51,6 +69,18 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def db_query_stats(request: Request, call_next):
+    """
+    Tracks the database calls of every request and reports them in the response headers.
+    """
+    with query_scope(f"{request.method} {request.url.path}") as stats:
+        response = await call_next(request)
+    response.headers["X-DB-Query-Count"] = str(stats.total_queries)
+    response.headers["X-DB-Query-Time-Ms"] = f"{stats.total_ms:.1f}"
+    return response
+
+
 @app.get("/health")
 async def health_check(request: Request):
     db: TurriDB = request.app.state.db
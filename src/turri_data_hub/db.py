@@ -1,14 +1,151 @@
-from typing import Literal, Type
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Iterable, Literal, Type
 
 from loguru import logger
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import Table, delete, literal_column, tuple_, update
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import RelationshipDirection
+from sqlalchemy.schema import CreateIndex
 from sqlmodel import SQLModel, select, text
 
 import src.turri_data_hub.chatbot.models  # noqa: F401
+import src.turri_data_hub.embedding  # noqa: F401
 import src.turri_data_hub.google_analytics.models  # noqa: F401
 import src.turri_data_hub.recommendation_system.models  # noqa: F401
+import src.turri_data_hub.update.models  # noqa: F401
 import src.turri_data_hub.woocommerce.models  # noqa: F401
+from src.turri_data_hub.query_stats import record_query, report_query
 from src.turri_data_hub.settings import database_settings
+from src.turri_data_hub.vector_indexes import get_vector_indexes
+
+UPSERT_CHUNK_SIZE = 500
+STREAM_BATCH_SIZE = 200
+# asyncpg rejects statements with more bind parameters than this
+MAX_BIND_PARAMS = 32767
+
+
+def _collect_upsert_rows(
+    data: list[SQLModel],
+) -> tuple[dict[Table, dict[tuple, dict]], dict[Table, tuple[str, dict]]]:
+    """
+    Flattens SQLModel instances into column dicts grouped by table.
+
+    Loaded one-to-many children (e.g. Order.line_items) are collected alongside
+    their parent, and loaded many-to-many collections (e.g. Product.tags) are
+    turned into rows of their link table. Rows are keyed by primary key so that
+    duplicates collapse onto the last occurrence.
+
+    Raises:
+        ValueError: If a parent without a primary key has link rows to write.
+
+    Returns:
+        The rows per table and, per link table, the parent side column together
+        with the link rows each parent should end up with.
+    """
+    rows: dict[Table, dict[tuple, dict]] = defaultdict(dict)
+    links: dict[Table, tuple[str, dict]] = {}
+
+    pending = list(data)
+    i = 0
+    while i < len(pending):
+        obj = pending[i]
+        i += 1
+        state = sa_inspect(obj)
+        mapper = state.mapper
+        table = mapper.local_table
+
+        values = {
+            prop.columns[0].name: getattr(obj, prop.key)
+            for prop in mapper.column_attrs
+            if prop.key not in state.unloaded
+        }
+        pk = tuple(values.get(col.name) for col in table.primary_key.columns)
+        if None in pk:
+            # let the database assign the key, these rows can never conflict
+            for col in table.primary_key.columns:
+                values.pop(col.name, None)
+            rows[table][("__new__", len(rows[table]))] = values
+        else:
+            rows[table][pk] = values
+
+        for rel in mapper.relationships:
+            if rel.key in state.unloaded:
+                continue
+            related = obj.__dict__.get(rel.key)
+            if rel.direction is RelationshipDirection.ONETOMANY:
+                for child in related or []:
+                    for parent_col, child_col in rel.synchronize_pairs:
+                        if getattr(child, child_col.key, None) is None:
+                            setattr(child, child_col.key, getattr(obj, parent_col.key))
+                    pending.append(child)
+            elif rel.secondary is not None:
+                if None in pk:
+                    if related:
+                        raise ValueError(
+                            f"Cannot write {mapper.class_.__name__}.{rel.key} link "
+                            "rows without the parent's primary key"
+                        )
+                    continue
+                (parent_col, link_parent_col), *_ = rel.synchronize_pairs
+                link_rows = [
+                    {
+                        link_parent_col.name: values[parent_col.name],
+                        **{
+                            link_col.name: getattr(child, target_col.key)
+                            for target_col, link_col in rel.secondary_synchronize_pairs
+                        },
+                    }
+                    for child in related or []
+                ]
+                _, per_parent = links.setdefault(
+                    rel.secondary, (link_parent_col.name, {})
+                )
+                per_parent[values[parent_col.name]] = link_rows
+
+    for table, (_, per_parent) in links.items():
+        for link_rows in per_parent.values():
+            for row in link_rows:
+                pk = tuple(row[col.name] for col in table.primary_key.columns)
+                rows[table][pk] = row
+
+    return rows, links
+
+
+async def set_ef_search(session: AsyncSession, ef_search: int) -> None:
+    """
+    Sets the HNSW candidate list size for the rest of the session's transaction.
+    Higher values give better recall at the cost of speed (pgvector default is 40).
+    """
+    await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+
+
+def _build_select(
+    table_model: Type[SQLModel],
+    where_clauses: list = None,
+    order_by: list = None,
+    limit: None | int = None,
+    options: list = None,
+):
+    statement = select(table_model)
+    if options:
+        for opt in options:
+            statement = statement.options(opt)
+    if where_clauses:
+        for clause in where_clauses:
+            statement = statement.where(clause)
+    if order_by:
+        for order in order_by:
+            statement = statement.order_by(order)
+    if limit:
+        statement = statement.limit(limit)
+    return statement
 
 
 class TurriDB:
@@ -35,20 +172,189 @@ class TurriDB:
             "Database tables created (if they didn't exist), and 'vector' extension ensured."
         )
 
+    async def create_vector_indexes(self) -> list[str]:
+        """
+        Creates the HNSW/IVFFlat indexes missing on existing tables without blocking
+        reads or writes. create_all only builds them along with new tables.
+
+        Returns:
+            list[str]: Names of the indexes that were created.
+        """
+        names = []
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.execute(text("SELECT indexname FROM pg_indexes"))
+            existing = set(result.scalars())
+            for index in get_vector_indexes(SQLModel.metadata):
+                if index.name in existing:
+                    continue
+                logger.info(f"Creating vector index {index.name}")
+                ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+                await conn.execute(
+                    text(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+                )
+                names.append(index.name)
+        return names
+
+    async def rebuild_vector_indexes(self) -> list[str]:
+        """
+        Rebuilds all HNSW/IVFFlat indexes without blocking reads or writes.
+        Useful after large catalog changes degraded the index graph.
+        """
+        names = []
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for index in get_vector_indexes(SQLModel.metadata):
+                logger.info(f"Rebuilding vector index {index.name}")
+                await conn.execute(text(f'REINDEX INDEX CONCURRENTLY "{index.name}"'))
+                names.append(index.name)
+        return names
+
     async def save_all(self, data: list[Type[SQLModel]]) -> None:
         """
         Saves a list of SQLModel instances to the database.
         """
 
-        async with self.session_maker() as sess:
-            for obj in data:
-                await sess.merge(obj)
-            await sess.commit()
+        tables = sorted({type(obj).__tablename__ for obj in data})
+        with record_query("save_all", f"MERGE {', '.join(tables)}") as record:
+            async with self.session_maker() as sess:
+                for obj in data:
+                    await sess.merge(obj)
+                await sess.commit()
+            record.rows = len(data)
+
+    async def upsert_all(
+        self, data: list[SQLModel], chunk_size: int = UPSERT_CHUNK_SIZE
+    ) -> tuple[int, int]:
+        """
+        Bulk upserts SQLModel instances using multi-row INSERT ... ON CONFLICT statements.
+
+        Objects are grouped by table and written in foreign key order, at most
+        `chunk_size` rows per statement, inside a single transaction. Loaded
+        one-to-many children are upserted with their parent and loaded
+        many-to-many collections replace the parent's rows in the link table.
+        Many-to-one relationships are not followed, set the foreign key column instead.
+
+        Returns:
+            tuple[int, int]: Number of inserted and updated rows over all tables.
+        """
+        rows, links = _collect_upsert_rows(data)
+        inserted = 0
+        updated = 0
+
+        shape = f"UPSERT {', '.join(sorted(table.name for table in rows))}"
+        with record_query("upsert_all", shape) as record:
+            async with self.session_maker() as sess:
+                for table in SQLModel.metadata.sorted_tables:
+                    if table in rows:
+                        ins, upd = await self._upsert_table(
+                            sess, table, rows[table], links.get(table), chunk_size
+                        )
+                        inserted += ins
+                        updated += upd
+                await sess.commit()
+            record.rows = inserted + updated
+
+        return inserted, updated
+
+    @staticmethod
+    async def _upsert_table(
+        sess: AsyncSession,
+        table: Table,
+        rows: dict[tuple, dict],
+        links: tuple[str, dict] | None,
+        chunk_size: int,
+    ) -> tuple[int, int]:
+        inserted = 0
+        updated = 0
+        pk_names = [col.name for col in table.primary_key.columns]
+
+        # concurrent upserts lock overlapping rows in the same order, by primary
+        # key, instead of deadlocking; rows without a key go last
+        ordered = sorted(
+            rows.items(), key=lambda item: (item[0][0] == "__new__", item[0])
+        )
+        by_columns: dict[tuple, list[dict]] = defaultdict(list)
+        for _, values in ordered:
+            by_columns[tuple(values)].append(values)
+
+        for columns, group in by_columns.items():
+            update_cols = [c for c in columns if c not in pk_names]
+            per_chunk = max(1, min(chunk_size, MAX_BIND_PARAMS // len(columns)))
+            for start in range(0, len(group), per_chunk):
+                stmt = pg_insert(table).values(group[start : start + per_chunk])
+                if not set(pk_names) <= set(columns):
+                    stmt = stmt.returning(literal_column("true"))
+                elif update_cols:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=pk_names,
+                        set_={c: stmt.excluded[c] for c in update_cols},
+                    ).returning(literal_column("xmax = 0"))
+                else:
+                    stmt = stmt.on_conflict_do_nothing(
+                        index_elements=pk_names
+                    ).returning(literal_column("true"))
+
+                flags = (await sess.execute(stmt)).scalars().all()
+                inserted += sum(flags)
+                updated += len(flags) - sum(flags)
+
+        if links:
+            # drop link rows the parents no longer have
+            parent_col, per_parent = links
+            keep = [
+                tuple(row[name] for name in pk_names)
+                for link_rows in per_parent.values()
+                for row in link_rows
+            ]
+            stmt = delete(table).where(table.c[parent_col].in_(per_parent))
+            if keep:
+                pk = tuple_(*[table.c[name] for name in pk_names])
+                stmt = stmt.where(pk.not_in(keep))
+            await sess.execute(stmt)
+
+        return inserted, updated
 
     async def save(self, resp: Type[SQLModel]) -> None:
-        async with self.session_maker() as sess:
-            await sess.merge(resp)
-            await sess.commit()
+        with record_query("save", f"MERGE {resp.__tablename__}") as record:
+            async with self.session_maker() as sess:
+                await sess.merge(resp)
+                await sess.commit()
+            record.rows = 1
+
+    async def update_where(
+        self, table_model: Type[SQLModel], where_clauses: list, values: dict
+    ) -> int:
+        """
+        Sets `values` on all rows matching `where_clauses` in one UPDATE.
+
+        Returns:
+            int: Number of updated rows.
+        """
+        statement = update(table_model).where(*where_clauses).values(**values)
+        with record_query("update_where", statement) as record:
+            async with self.session_maker() as sess:
+                result = await sess.execute(statement)
+                await sess.commit()
+            record.rows = result.rowcount
+        return result.rowcount
+
+    async def delete_where(
+        self, table_model: Type[SQLModel], where_clauses: list
+    ) -> int:
+        """
+        Deletes all rows matching `where_clauses` in one DELETE.
+
+        Returns:
+            int: Number of deleted rows.
+        """
+        statement = delete(table_model).where(*where_clauses)
+        with record_query("delete_where", statement) as record:
+            async with self.session_maker() as sess:
+                result = await sess.execute(statement)
+                await sess.commit()
+            record.rows = result.rowcount
+        return result.rowcount
 
     async def refresh_all(self):
         """
@@ -79,21 +385,105 @@ class TurriDB:
         limit: None | int = None,
         mode: Literal["all", "first"] = "all",
         options: list = None,
+        ef_search: int | None = None,
     ) -> list[SQLModel] | SQLModel | None:
+        """
+        Selects rows of `table_model`. Pass `ef_search` when ordering by a vector
+        distance to trade recall against speed of the HNSW index scan.
+        """
         async with self.session_maker() as session:
-            statement = select(table_model)
-            if options:
-                for opt in options:
-                    statement = statement.options(opt)
-            if where_clauses:
-                for clause in where_clauses:
-                    statement = statement.where(clause)
-            if order_by:
-                for order in order_by:
-                    statement = statement.order_by(order)
-            if limit:
-                statement = statement.limit(limit)
-            result = await session.execute(statement)
-            if mode == "first":
-                return result.scalars().first()
-            return list(result.scalars().all())
+            if ef_search is not None:
+                await set_ef_search(session, ef_search)
+            statement = _build_select(
+                table_model, where_clauses, order_by, limit, options
+            )
+            with record_query("query_table", statement) as record:
+                result = await session.execute(statement)
+                if mode == "first":
+                    obj = result.scalars().first()
+                    record.rows = int(obj is not None)
+                    return obj
+                objs = list(result.scalars().all())
+                record.rows = len(objs)
+                return objs
+
+    async def get_many(
+        self,
+        table_model: Type[SQLModel],
+        ids: Iterable[Any],
+        options: list = None,
+    ) -> dict[Any, SQLModel]:
+        """
+        Fetches all rows with the given primary keys in a single IN query.
+
+        Returns:
+            dict: Primary key to object. Ids that don't exist are missing from the map.
+        """
+        ids = set(ids)
+        if not ids:
+            return {}
+
+        mapper = sa_inspect(table_model)
+        pk_col = mapper.primary_key[0]
+        pk_attr = mapper.get_property_by_column(pk_col).key
+        rows = await self.query_table(
+            table_model, where_clauses=[pk_col.in_(ids)], options=options
+        )
+        return {getattr(row, pk_attr): row for row in rows}
+
+    async def query_ids(
+        self, table_model: Type[SQLModel], where_clauses: list = None
+    ) -> set[Any]:
+        """
+        Primary keys of all rows matching `where_clauses`, without loading the rows.
+        """
+        pk_col = sa_inspect(table_model).primary_key[0]
+        statement = select(pk_col)
+        if where_clauses:
+            statement = statement.where(*where_clauses)
+        with record_query("query_ids", statement) as record:
+            async with self.session_maker() as session:
+                ids = set((await session.execute(statement)).scalars().all())
+            record.rows = len(ids)
+        return ids
+
+    async def stream_table(
+        self,
+        table_model: Type[SQLModel],
+        where_clauses: list = None,
+        options: list = None,
+        batch_size: int = STREAM_BATCH_SIZE,
+    ) -> AsyncIterator[list[SQLModel]]:
+        """
+        Like query_table, but yields the rows in primary key order in lists of at
+        most `batch_size`, so only one batch is held in memory at a time.
+
+        Every batch is its own keyset paginated query (primary key greater than
+        the last one seen), no connection or transaction stays open while the
+        caller works on a batch.
+        """
+        (pk,) = sa_inspect(table_model).primary_key
+        statement = _build_select(
+            table_model, where_clauses, [pk], limit=batch_size, options=options
+        )
+
+        elapsed_ms = 0.0
+        rows = 0
+        last = None
+        try:
+            while True:
+                page = statement if last is None else statement.where(pk > last)
+                start = time.perf_counter()
+                async with self.session_maker() as session:
+                    batch = list((await session.execute(page)).scalars().all())
+                elapsed_ms += (time.perf_counter() - start) * 1000
+                if not batch:
+                    break
+                rows += len(batch)
+                yield batch
+                if len(batch) < batch_size:
+                    break
+                last = getattr(batch[-1], pk.key)
+        finally:
+            # only the time spent fetching counts, not the time the caller took
+            report_query("stream_table", statement, elapsed_ms, rows)
@@ -1,24 +1,422 @@
 import asyncio
+import hashlib
+import random
+import time
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING
 
+import httpx
+import numpy as np
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from loguru import logger
+from pgvector.sqlalchemy import Vector
+from redis import asyncio as aioredis
+from sqlmodel import Column, Field, SQLModel
 
 from .settings import database_settings
 
+if TYPE_CHECKING:
+    from .db import TurriDB
+
 EMBEDDING_DIM = 768
 
 
-async def compute_embeddings(contents: list[str]) -> list[list[float]]:
-    def sync_func():
-        client = genai.Client(api_key=database_settings.GOOGLE_API_KEY)
-        return client.models.embed_content(
-            model=database_settings.embedding_model,
+class EmbeddingCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    model: str
+    embedding: list[float] = Field(sa_column=Column(Vector(EMBEDDING_DIM)))
+    created_at: datetime
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model: str) -> str:
+    """
+    Hash of everything that determines an embedding: model, dimensionality and text.
+    """
+    parts = (model, str(EMBEDDING_DIM), normalize_text(text))
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class EmbeddingBackend(ABC):
+    """
+    Produces EMBEDDING_DIM sized embeddings for a batch of texts. `model` names
+    the embedding space, cached embeddings are only reused within the same model.
+    """
+
+    model: str
+
+    @abstractmethod
+    async def embed_batch(self, contents: list[str]) -> list[list[float]]: ...
+
+    def is_input_error(self, error: Exception) -> bool:
+        """
+        Whether the request was rejected because of one of its texts, so smaller
+        batches may still succeed.
+        """
+        return False
+
+    def is_transient_error(self, error: Exception) -> bool:
+        """
+        Whether the same request may succeed later, e.g. rate limits and
+        overloaded servers.
+        """
+        return False
+
+
+class GeminiEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model: str = database_settings.embedding_model):
+        self.model = model
+        self._client: genai.Client | None = None
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            self._client = genai.Client(api_key=database_settings.GOOGLE_API_KEY)
+        return self._client
+
+    async def embed_batch(self, contents: list[str]) -> list[list[float]]:
+        result = await self.client.aio.models.embed_content(
+            model=self.model,
             contents=contents,
             config=types.EmbedContentConfig(
                 task_type="SEMANTIC_SIMILARITY", output_dimensionality=EMBEDDING_DIM
             ),
         )
+        return [embedding.values for embedding in result.embeddings]
+
+    def is_input_error(self, error: Exception) -> bool:
+        return isinstance(error, errors.ClientError) and (
+            error.code == 400 or error.status == "INVALID_ARGUMENT"
+        )
+
+    def is_transient_error(self, error: Exception) -> bool:
+        if isinstance(error, errors.APIError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, (httpx.TransportError, TimeoutError))
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic offline embeddings for tests and benchmarks: character n-grams
+    of the normalized, lowercased text hashed into EMBEDDING_DIM signed buckets
+    and L2 normalized. Texts sharing many n-grams end up close to each other.
+    """
+
+    def __init__(self, ngram_sizes: tuple[int, ...] = (3, 4)):
+        self.ngram_sizes = ngram_sizes
+        self.model = f"hashing-ngrams-{'-'.join(map(str, ngram_sizes))}"
+
+    def _embed(self, text: str) -> list[float]:
+        text = f" {normalize_text(text).lower()} "
+        ngrams = Counter(
+            text[i : i + n] for n in self.ngram_sizes for i in range(len(text) - n + 1)
+        )
+        vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+        for ngram, count in ngrams.items():
+            value = zlib.crc32(ngram.encode())
+            vector[value % EMBEDDING_DIM] += count if value & 0x80000000 else -count
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    async def embed_batch(self, contents: list[str]) -> list[list[float]]:
+        return [self._embed(content) for content in contents]
+
+
+EMBEDDING_BACKENDS: dict[str, type[EmbeddingBackend]] = {
+    "gemini": GeminiEmbeddingBackend,
+    "hashing": HashingEmbeddingBackend,
+}
+
+
+class EmbeddingService:
+    """
+    Long-lived access to the embedding backend.
+
+    Coalesces the texts of concurrent calls,
+    e.g. single queries from several chat requests, into batched requests: a batch
+    is sent once it reaches `batch_size` texts or `window_ms` after its first text
+    arrived. At most `max_concurrency` batches are in flight at a time. Rate
+    limited or transiently failing batches are retried up to `max_retries` times.
+
+    Given a TurriDB, embeddings are looked up in and added to the
+    EmbeddingCacheEntry table first, so unchanged texts are never re-embedded.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        batch_size: int = database_settings.embedding_batch_size,
+        window_ms: float = database_settings.embedding_batch_window_ms,
+        max_concurrency: int = database_settings.embedding_max_concurrency,
+        max_retries: int = database_settings.embedding_max_retries,
+        backoff_base_s: float = database_settings.embedding_backoff_base_s,
+        backoff_max_s: float = database_settings.embedding_backoff_max_s,
+    ):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.window_ms = window_ms
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # the loop only keeps weak references to tasks, a batch in flight must not
+        # be garbage collected
+        self._tasks: set[asyncio.Task] = set()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _bind_loop(self) -> None:
+        # futures and semaphores belong to one event loop, scripts may run several
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._pending = []
+            self._flush_handle = None
+            self._tasks = set()
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else None,
+        }
+
+    async def embed(
+        self, contents: list[str], db: "TurriDB | None" = None
+    ) -> list[list[float]]:
+        if db is None:
+            return await self._embed(contents)
+
+        keys = [cache_key(content, self.backend.model) for content in contents]
+        cached: dict[str, EmbeddingCacheEntry] = await db.get_many(
+            EmbeddingCacheEntry, keys
+        )
+        embeddings = {
+            key: np.asarray(entry.embedding).tolist() for key, entry in cached.items()
+        }
+        missing = {
+            key: content for key, content in zip(keys, contents) if key not in cached
+        }
+        self.cache_hits += len(contents) - len(missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            computed = await self._embed(list(missing.values()))
+            embeddings.update(zip(missing, computed))
+            now = datetime.now()
+            await db.upsert_all(
+                [
+                    EmbeddingCacheEntry(
+                        key=key,
+                        model=self.backend.model,
+                        embedding=embedding,
+                        created_at=now,
+                    )
+                    for key, embedding in zip(missing, computed)
+                ]
+            )
+        return [embeddings[key] for key in keys]
+
+    async def _embed(self, contents: list[str]) -> list[list[float]]:
+        self._bind_loop()
+        futures = []
+        for content in contents:
+            future = self._loop.create_future()
+            self._pending.append((content, future))
+            futures.append(future)
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(
+                self.window_ms / 1000, self._flush
+            )
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = self._loop.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        """
+        Embeds one batch. Rate limits and transient errors retry the whole batch
+        with backoff. A batch rejected because of its input is split in halves and
+        each half is retried, so only the texts that keep failing fail their
+        callers. Any other error fails the whole batch at once.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    embeddings = await self.backend.embed_batch(
+                        [content for content, _ in batch]
+                    )
+                if len(embeddings) != len(batch):
+                    raise ValueError(
+                        f"Got {len(embeddings)} embeddings for {len(batch)} texts"
+                    )
+            except Exception as e:
+                if self.backend.is_transient_error(e) and attempt < self.max_retries:
+                    # full jitter, so batches hitting the same limit spread out
+                    delay = min(
+                        self.backoff_max_s,
+                        random.uniform(0, self.backoff_base_s * 2**attempt),
+                    )
+                    attempt += 1
+                    logger.warning(
+                        f"Embedding batch of {len(batch)} failed ({e}), "
+                        f"retry {attempt} in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                if self.backend.is_input_error(e) and len(batch) > 1:
+                    logger.warning(
+                        f"Embedding batch of {len(batch)} rejected ({e}), "
+                        "retrying in halves"
+                    )
+                    middle = len(batch) // 2
+                    await asyncio.gather(
+                        self._send(batch[:middle]), self._send(batch[middle:])
+                    )
+                    return
+                logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            break
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+
+class QueryEmbeddingCache:
+    """
+    TTL/LRU cache for the embeddings of search queries, which the chat agents
+    repeat a lot across sessions.
+
+    Entries are keyed like the cache table, by model, dimensionality and normalized
+    text. The in-process map holds at most `max_size` entries and evicts the least
+    recently used first. With a `redis_url` misses fall through to Redis, so the
+    cache is shared between processes and survives restarts.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_size: int = database_settings.query_embedding_cache_size,
+        ttl_s: float = database_settings.query_embedding_cache_ttl_s,
+        redis_url: str | None = database_settings.query_embedding_cache_redis_url,
+    ):
+        self.model = model
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._redis = aioredis.from_url(redis_url) if redis_url else None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def get(self, text: str) -> list[float] | None:
+        key = cache_key(text, self.model)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, embedding = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            del self._entries[key]
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(f"query_embedding:{key}")
+            except aioredis.RedisError as e:
+                logger.warning(f"Query embedding cache Redis lookup failed: {e}")
+                raw = None
+            if raw is not None:
+                embedding = np.frombuffer(raw, dtype=np.float32).tolist()
+                self._store(key, embedding)
+                self.redis_hits += 1
+                return embedding
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, embedding: list[float]) -> None:
+        key = cache_key(text, self.model)
+        self._store(key, embedding)
+        if self._redis is not None:
+            try:
+                await self._redis.set(
+                    f"query_embedding:{key}",
+                    np.asarray(embedding, dtype=np.float32).tobytes(),
+                    ex=int(self.ttl_s),
+                )
+            except aioredis.RedisError as e:
+                logger.warning(f"Query embedding cache Redis write failed: {e}")
+
+    def _store(self, key: str, embedding: list[float]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_s, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                round((self.hits + self.redis_hits) / lookups, 4) if lookups else None
+            ),
+        }
+
+
+embedding_service = EmbeddingService(
+    EMBEDDING_BACKENDS[database_settings.embedding_backend]()
+)
+query_embedding_cache = QueryEmbeddingCache(embedding_service.backend.model)
+
+
+async def compute_embeddings(
+    contents: list[str], db: "TurriDB | None" = None
+) -> list[list[float]]:
+    """
+    Embeds the texts, passing a TurriDB serves unchanged texts from the cache table.
+    """
+    return await embedding_service.embed(contents, db=db)
 
-    result = await asyncio.to_thread(sync_func)
 
-    return [emb.values for emb in result.embeddings]
+async def embed_query(query: str) -> list[float]:
+    """
+    Embeds a single search query, served from the query embedding cache if possible.
+    """
+    embedding = await query_embedding_cache.get(query)
+    if embedding is None:
+        embedding = (await embedding_service.embed([query]))[0]
+        await query_embedding_cache.set(query, embedding)
+    return embedding
@@ -0,0 +1,15 @@
+from sqlalchemy.orm import declared_attr, deferred
+
+
+def defer_columns(*names: str) -> declared_attr:
+    """
+    `__mapper_args__` for a SQLModel table that leaves the given columns out of
+    every SELECT. Callers that need them opt in with `undefer(Model.column)`,
+    reading them without doing so raises once the session is closed.
+    """
+
+    @declared_attr
+    def __mapper_args__(cls) -> dict:
+        return {"properties": {name: deferred(cls.__table__.c[name]) for name in names}}
+
+    return __mapper_args__
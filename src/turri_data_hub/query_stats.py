@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from loguru import logger
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.elements import TextClause, _anonymous_label
+from sqlalchemy.sql.selectable import FromClause, Join
+
+from .settings import database_settings
+
+# A statement shape, SQL statements are only compiled to text when it is shown
+Shape = str | ClauseElement
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+_INTERNAL_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.py"),
+    os.path.abspath(contextlib.__file__),
+}
+_ASYNCIO_DIR = os.path.dirname(os.path.abspath(asyncio.__file__))
+
+
+class QueryRecord:
+    """
+    Handed out by `record_query`, the caller sets the number of rows it got back.
+    """
+
+    def __init__(self):
+        self.rows = 0
+
+
+class QueryStats:
+    """
+    Latency histograms, row counts and calling locations per statement shape.
+
+    One instance lives for the whole process and one per request or job scope,
+    see `query_scope`. Scoped instances also flag N+1 patterns: the same
+    statement shape issued from the same code location over and over.
+
+    Shapes given as SQL statements are grouped by their `_fingerprint`, the
+    statement type and tables, and compiled to text only once they are logged
+    or summarized.
+    """
+
+    def __init__(self, name: str, detect_n_plus_one: bool = True):
+        self.name = name
+        self.detect_n_plus_one = detect_n_plus_one
+        self.total_queries = 0
+        self.total_ms = 0.0
+        self.total_rows = 0
+        self.statements: dict[tuple[str, str], dict] = {}
+        self.n_plus_one: list[dict] = []
+
+    def record(
+        self, operation: str, shape: Shape, location: str, elapsed_ms: float, rows: int
+    ) -> None:
+        self.total_queries += 1
+        self.total_ms += elapsed_ms
+        self.total_rows += rows
+
+        entry = self.statements.setdefault(
+            (operation, _fingerprint(shape)),
+            {
+                "shape": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "histogram": [0] * len(LATENCY_BUCKETS_MS),
+                "locations": Counter(),
+            },
+        )
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["rows"] += rows
+        entry["histogram"][
+            next(i for i, b in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= b)
+        ] += 1
+        entry["locations"][location] += 1
+
+        if (
+            self.detect_n_plus_one
+            and entry["locations"][location] == database_settings.n_plus_one_threshold
+        ):
+            shape = _shape_text(entry)
+            self.n_plus_one.append(
+                {"operation": operation, "shape": _shorten(shape), "location": location}
+            )
+            logger.warning(
+                f"Possible N+1 in '{self.name}': {operation} issued "
+                f"{database_settings.n_plus_one_threshold}+ times from {location}: "
+                f"{_shorten(shape)}"
+            )
+
+    def summary(self, top: int = 20) -> dict:
+        """
+        Returns a JSON serializable overview, statements sorted by total time.
+        """
+        statements = sorted(
+            self.statements.items(), key=lambda kv: kv[1]["total_ms"], reverse=True
+        )
+        return {
+            "name": self.name,
+            "total_queries": self.total_queries,
+            "total_ms": round(self.total_ms, 2),
+            "total_rows": self.total_rows,
+            "n_plus_one": self.n_plus_one,
+            "statements": [
+                {
+                    "operation": operation,
+                    "shape": _shorten(_shape_text(entry)),
+                    "count": entry["count"],
+                    "total_ms": round(entry["total_ms"], 2),
+                    "max_ms": round(entry["max_ms"], 2),
+                    "rows": entry["rows"],
+                    "histogram": {
+                        f"<={bound}ms": n
+                        for bound, n in zip(LATENCY_BUCKETS_MS, entry["histogram"])
+                        if n
+                    },
+                    "locations": dict(entry["locations"].most_common(3)),
+                }
+                for (operation, _), entry in statements[:top]
+            ],
+        }
+
+
+global_query_stats = QueryStats("global", detect_n_plus_one=False)
+_current_stats: ContextVar[QueryStats | None] = ContextVar(
+    "current_query_stats", default=None
+)
+
+
+def _from_names(from_clause: FromClause) -> set[str]:
+    if isinstance(from_clause, Join):
+        return _from_names(from_clause.left) | _from_names(from_clause.right)
+    name = getattr(from_clause, "name", None)
+    # anonymous subqueries are named per statement instance
+    if not name or isinstance(name, _anonymous_label):
+        return {type(from_clause).__name__.lower()}
+    return {name}
+
+
+def _fingerprint(shape: Shape) -> str:
+    """
+    Cheap key of a statement shape without compiling it: the statement type and
+    the tables it writes or reads from.
+    """
+    if isinstance(shape, str):
+        return shape
+    if isinstance(shape, TextClause):
+        return shape.text
+    table = getattr(shape, "table", None)
+    if table is not None:
+        froms = [table]
+    elif hasattr(shape, "get_final_froms"):
+        froms = shape.get_final_froms()
+    else:
+        froms = []
+    names = sorted(set().union(*map(_from_names, froms)))
+    return f"{shape.__visit_name__.upper()} {', '.join(names)}".rstrip()
+
+
+def _shape_text(entry: dict) -> str:
+    # compiled once per entry, the compiled text replaces the statement
+    if not isinstance(entry["shape"], str):
+        entry["shape"] = str(entry["shape"])
+    return entry["shape"]
+
+
+def _shorten(shape: str, max_len: int = 200) -> str:
+    shape = re.sub(r"^SELECT .+? FROM ", "SELECT ... FROM ", " ".join(shape.split()))
+    return shape if len(shape) <= max_len else shape[: max_len - 3] + "..."
+
+
+def _caller_location() -> str:
+    """
+    First frame outside of TurriDB and this module, e.g. the agent tool or sync step.
+    """
+    frame = sys._getframe(1)
+    while frame and os.path.abspath(frame.f_code.co_filename) in _INTERNAL_FILES:
+        frame = frame.f_back
+    if frame is None or frame.f_code.co_filename.startswith(_ASYNCIO_DIR):
+        # called directly as a task, e.g. through asyncio.gather
+        task = asyncio.current_task()
+        return f"task {task.get_coro().__qualname__}" if task else "unknown"
+    filename = os.path.relpath(frame.f_code.co_filename)
+    return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+@contextmanager
+def query_scope(name: str) -> Iterator[QueryStats]:
+    """
+    Collects the stats of all TurriDB calls made inside, including from tasks
+    started inside the scope. Used per FastAPI request and per admin job.
+    """
+    stats = QueryStats(name)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        logger.debug(
+            f"[DB] {name}: {stats.total_queries} queries, "
+            f"{stats.total_ms:.1f}ms, {stats.total_rows} rows"
+        )
+
+
+@contextmanager
+def record_query(operation: str, shape: Shape) -> Iterator[QueryRecord]:
+    """
+    Times one TurriDB call and files it under the global and the current scope.
+    """
+    record = QueryRecord()
+    location = _caller_location()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        report_query(operation, shape, elapsed_ms, record.rows, location=location)
+
+
+def report_query(
+    operation: str,
+    shape: Shape,
+    elapsed_ms: float,
+    rows: int,
+    location: str | None = None,
+) -> None:
+    """
+    Files an already timed TurriDB call, for calls that can't be wrapped in
+    `record_query` such as streams that yield control between batches.
+    """
+    location = location or _caller_location()
+    global_query_stats.record(operation, shape, location, elapsed_ms, rows)
+    if stats := _current_stats.get():
+        stats.record(operation, shape, location, elapsed_ms, rows)
+    if elapsed_ms > database_settings.slow_query_ms:
+        logger.warning(
+            f"Slow query ({elapsed_ms:.0f}ms, {rows} rows) {operation} "
+            f"from {location}: {_shorten(str(shape))}"
+        )
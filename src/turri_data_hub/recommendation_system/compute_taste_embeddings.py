@@ -1,8 +1,25 @@
+from typing import Iterable
+
 import numpy as np
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import and_, cast, func, literal, union_all, update
+from sqlmodel import select
 
-from ..woocommerce.models import Producer, Product
+from ..db import TurriDB
+from ..query_stats import record_query
+from ..woocommerce.models import (
+    Producer,
+    Product,
+    ProductCategory,
+    ProductCategoryLink,
+    ProductTag,
+    ProductTagLink,
+)
+from .recommendation_index import recommendable
 from .taste_categories import TASTE_KEYS
 
+TASTE_INDEX = {key: i for i, key in enumerate(TASTE_KEYS)}
+
 
 def get_product_taste_embeddings(product: Product) -> list[bool]:
     """
@@ -24,3 +41,130 @@ def get_producer_taste_embeddings(producer: Producer) -> list[float]:
     if not product_embeddings:
         return [0.0] * len(TASTE_KEYS)
     return np.mean(product_embeddings, axis=0).tolist()
+
+
+def get_taste_matrix(
+    product_ids: list[int], names: Iterable[tuple[int, str]]
+) -> np.ndarray:
+    """
+    Taste embeddings of many products at once from (product id, tag or category
+    name) pairs, row i is what get_product_taste_embeddings returns for
+    product_ids[i].
+    """
+    rows = {product_id: i for i, product_id in enumerate(product_ids)}
+    hits = np.asarray(
+        [
+            (rows[product_id], TASTE_INDEX[name])
+            for product_id, name in names
+            if product_id in rows and name in TASTE_INDEX
+        ],
+        dtype=np.intp,
+    ).reshape(-1, 2)
+    matrix = np.zeros((len(product_ids), len(TASTE_KEYS)), dtype=bool)
+    matrix[hits[:, 0], hits[:, 1]] = True
+    return matrix
+
+
+async def update_product_tastes(db: TurriDB) -> list[int]:
+    """
+    Recomputes the taste embeddings of all products in one pass and writes the
+    ones that changed, because the product's tags or categories changed or one
+    of them was renamed.
+
+    Returns:
+        list: Ids of the products whose taste embedding changed.
+    """
+    stored = select(Product.id, Product.taste_embedding).order_by(Product.id)
+    names = union_all(
+        select(ProductTagLink.product_id, ProductTag.name)
+        .join(ProductTag, ProductTag.id == ProductTagLink.tag_id)
+        .where(ProductTag.name.in_(TASTE_KEYS)),
+        select(ProductCategoryLink.product_id, ProductCategory.name)
+        .join(ProductCategory, ProductCategory.id == ProductCategoryLink.category_id)
+        .where(ProductCategory.name.in_(TASTE_KEYS)),
+    )
+
+    async with db.session_maker() as session:
+        with record_query("update_product_tastes", stored) as record:
+            rows = (await session.execute(stored)).all()
+            record.rows = len(rows)
+        with record_query("update_product_tastes", names) as record:
+            pairs = (await session.execute(names)).all()
+            record.rows = len(pairs)
+
+        ids = [row.id for row in rows]
+        tastes = get_taste_matrix(ids, pairs)
+        # products never computed before compare unequal to everything
+        current = np.asarray(
+            [
+                row.taste_embedding
+                if row.taste_embedding is not None
+                else [np.nan] * len(TASTE_KEYS)
+                for row in rows
+            ],
+            dtype=np.float32,
+        ).reshape(len(rows), len(TASTE_KEYS))
+        changed = np.flatnonzero((current != tastes).any(axis=1))
+        if not len(changed):
+            return []
+
+        with record_query("update_product_tastes", "UPDATE product") as record:
+            await session.execute(
+                update(Product),
+                [
+                    {"id": ids[i], "taste_embedding": tastes[i].astype(float).tolist()}
+                    for i in changed
+                ],
+            )
+            await session.commit()
+            record.rows = len(changed)
+    return [ids[i] for i in changed]
+
+
+async def update_producer_tastes(
+    db: TurriDB, producer_ids: Iterable[int] | None = None
+) -> list[int]:
+    """
+    Sets the taste embedding of all producers, or of `producer_ids`, to the
+    average of their `recommendable` products' in one UPDATE, zeros for
+    producers without any. Rows that would not change are left alone.
+
+    Returns:
+        list: Ids of the producers whose taste embedding changed.
+    """
+    dim = len(TASTE_KEYS)
+    averages = (
+        select(
+            Producer.id.label("producer_id"),
+            func.coalesce(
+                func.avg(Product.taste_embedding, type_=Vector(dim)),
+                cast(literal(str([0.0] * dim)), Vector(dim)),
+            ).label("taste"),
+        )
+        .select_from(Producer)
+        .outerjoin(
+            Product,
+            and_(Product.producer_id == Producer.id, *recommendable(Product)),
+        )
+        .group_by(Producer.id)
+    )
+    if producer_ids is not None:
+        averages = averages.where(Producer.id.in_(set(producer_ids)))
+    averages = averages.subquery()
+    statement = (
+        update(Producer)
+        .where(
+            Producer.id == averages.c.producer_id,
+            Producer.taste_embedding.is_distinct_from(averages.c.taste),
+        )
+        .values(taste_embedding=averages.c.taste)
+        .returning(Producer.id)
+        .execution_options(synchronize_session=False)
+    )
+
+    with record_query("update_producer_tastes", statement) as record:
+        async with db.session_maker() as session:
+            changed = list((await session.execute(statement)).scalars().all())
+            await session.commit()
+        record.rows = len(changed)
+    return changed
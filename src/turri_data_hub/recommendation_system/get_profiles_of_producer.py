@@ -1,4 +1,5 @@
 from sqlalchemy import distinct, select
+from sqlalchemy.orm import undefer
 
 from ..db import TurriDB
 from ..woocommerce.models import LineItem, Order, Product
@@ -6,7 +7,7 @@ from .models import UserBehavior
 
 
 async def get_customer_profiles_of_producer(
-    db: TurriDB, producer_id: int
+    db: TurriDB, producer_id: int, with_embeddings: bool = True
 ) -> list[UserBehavior]:
     product_ids = await db.query_table(
         Product, where_clauses=[Product.producer_id == producer_id], mode="all"
@@ -31,10 +32,14 @@ async def get_customer_profiles_of_producer(
 
     # 3. Get all UserBehavior for these customer ids
     res: list[UserBehavior] = await db.query_table(
-        UserBehavior, where_clauses=[UserBehavior.user_id.in_(customer_ids)], mode="all"
+        UserBehavior,
+        where_clauses=[UserBehavior.user_id.in_(customer_ids)],
+        mode="all",
+        options=[undefer(UserBehavior.embedding)] if with_embeddings else None,
     )
     for profile in res:
-        profile.embedding = profile.embedding.tolist()
+        if with_embeddings:
+            profile.embedding = profile.embedding.tolist()
         profile.taste_embedding = profile.taste_embedding.tolist()
 
     return res
@@ -1,13 +1,17 @@
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from sqlmodel import select
 
-from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.db import TurriDB, set_ef_search
 
 from ..woocommerce.models import Producer, Product
 from .models import UserBehavior
+from .recommendation_index import recommendable, recommendation_index
 
 CATEGORIES_FACTOR = 4
 EMBEDDINGS_FACTOR = 1
+# Distance used for a row that only made it into one of the two candidate lists
+MISSING_DISTANCE = 1000
 
 
 async def _hybrid_top_k(
@@ -17,80 +21,117 @@ async def _hybrid_top_k(
     model,
     taste_embedding_attr: str = "taste_embedding",
     embedding_attr: str = "embedding",
+    ef_search: int | None = None,
+    categories_factor: float = CATEGORIES_FACTOR,
+    embeddings_factor: float = EMBEDDINGS_FACTOR,
 ):
     """
     Generic hybrid search for a model with taste_embedding and embedding.
+    `ef_search` tunes the recall of the HNSW index scans, None keeps the server default.
+
+    Runs as a single statement: the k*3 nearest rows per embedding (both served by
+    the HNSW indexes) are full outer joined into the candidates, a distance missing
+    from one of the two candidate lists counts as MISSING_DISTANCE. Only the
+    candidates are joined back onto the model by primary key.
+
+    Served from the in-memory `recommendation_index` once it is loaded, the
+    statement below is the fallback while it is cold.
     """
-    async with db.session_maker() as session:
-        # Taste embedding distance
-        taste_stmt = (
-            select(
-                model,
-                getattr(model, taste_embedding_attr)
-                .l2_distance(user.taste_embedding)
-                .label("taste_score"),
-            )
-            .order_by(
-                getattr(model, taste_embedding_attr).l2_distance(user.taste_embedding)
-            )
-            .limit(k * 3)
+    if (
+        recommendation_index.is_ready(model)
+        and taste_embedding_attr == "taste_embedding"
+        and embedding_attr == "embedding"
+    ):
+        top_ids = recommendation_index.top_k_ids(
+            model, user, k, categories_factor, embeddings_factor, MISSING_DISTANCE
         )
-        taste_results = await session.execute(taste_stmt)
-        taste_scores = {
-            getattr(row, model.__name__).id: getattr(row, "taste_score")
-            for row in taste_results.fetchall()
-        }
+        options = [joinedload(Product.producer)] if model is Product else None
+        rows = await db.get_many(model, top_ids, options=options)
+        return [rows[pid] for pid in top_ids if pid in rows]
 
-        # Embedding distance
-        emb_stmt = (
-            select(
-                model,
-                getattr(model, embedding_attr)
-                .l2_distance(user.embedding)
-                .label("emb_score"),
-            )
-            .order_by(getattr(model, embedding_attr).l2_distance(user.embedding))
-            .limit(k * 3)
-        )
-        emb_results = await session.execute(emb_stmt)
-        emb_scores = {
-            getattr(row, model.__name__).id: getattr(row, "emb_score")
-            for row in emb_results.fetchall()
-        }
+    taste_distance = getattr(model, taste_embedding_attr).l2_distance(
+        user.taste_embedding
+    )
+    emb_distance = getattr(model, embedding_attr).l2_distance(user.embedding)
+
+    taste = (
+        select(model.id, taste_distance.label("distance"))
+        .where(*recommendable(model))
+        .order_by(taste_distance, model.id)
+        .limit(k * 3)
+        .cte("taste_candidates")
+    )
+    emb = (
+        select(model.id, emb_distance.label("distance"))
+        .where(*recommendable(model))
+        .order_by(emb_distance, model.id)
+        .limit(k * 3)
+        .cte("emb_candidates")
+    )
+    score = categories_factor * func.coalesce(
+        taste.c.distance, MISSING_DISTANCE
+    ) + embeddings_factor * func.coalesce(emb.c.distance, MISSING_DISTANCE)
+    candidates = (
+        select(func.coalesce(taste.c.id, emb.c.id).label("id"), score.label("score"))
+        .select_from(taste.join(emb, taste.c.id == emb.c.id, full=True))
+        .cte("candidates")
+    )
 
-        # Merge and score
-        all_ids = set(taste_scores) | set(emb_scores)
-        scored = []
-        for pid in all_ids:
-            taste = taste_scores.get(pid, 1000)
-            emb = emb_scores.get(pid, 1000)
-            score = CATEGORIES_FACTOR * taste + EMBEDDINGS_FACTOR * emb
-            scored.append((pid, score))
+    stmt = (
+        select(model)
+        .join(candidates, candidates.c.id == model.id)
+        .order_by(candidates.c.score, model.id)
+        .limit(k)
+    )
+    if model is Product:
+        stmt = stmt.options(joinedload(Product.producer))
 
-        scored.sort(key=lambda x: x[1])
-        top_ids = [pid for pid, _ in scored[:k]]
-        if not top_ids:
-            return []
-        # Use selectinload for Product.producer if model is Product
-        stmt = select(model).where(model.id.in_(top_ids))
-        if model is Product:
-            stmt = stmt.options(selectinload(Product.producer))
-        objs = await session.execute(stmt)
-        id_to_obj = {o.id: o for o in objs.scalars().all()}
-        return [id_to_obj[pid] for pid in top_ids if pid in id_to_obj]
+    async with db.session_maker() as session:
+        if ef_search is not None:
+            await set_ef_search(session, ef_search)
+        results = await session.execute(stmt)
+        return list(results.scalars().all())
 
 
-async def get_top_k_products(db: TurriDB, user: UserBehavior, k: int) -> list[Product]:
+async def get_top_k_products(
+    db: TurriDB,
+    user: UserBehavior,
+    k: int,
+    ef_search: int | None = None,
+    categories_factor: float = CATEGORIES_FACTOR,
+    embeddings_factor: float = EMBEDDINGS_FACTOR,
+) -> list[Product]:
     """
     Hybrid search: combine taste_embedding and embedding similarity for products.
     """
-    return await _hybrid_top_k(db, user, k, Product)
+    return await _hybrid_top_k(
+        db,
+        user,
+        k,
+        Product,
+        ef_search=ef_search,
+        categories_factor=categories_factor,
+        embeddings_factor=embeddings_factor,
+    )
 
 
 async def get_top_k_producers(
-    db: TurriDB, user: UserBehavior, k: int
+    db: TurriDB,
+    user: UserBehavior,
+    k: int,
+    ef_search: int | None = None,
+    categories_factor: float = CATEGORIES_FACTOR,
+    embeddings_factor: float = EMBEDDINGS_FACTOR,
 ) -> list[Producer]:
     """
     Hybrid search: combine taste_embedding and embedding similarity for producers.
     """
-    return await _hybrid_top_k(db, user, k, Producer)
+    return await _hybrid_top_k(
+        db,
+        user,
+        k,
+        Producer,
+        ef_search=ef_search,
+        categories_factor=categories_factor,
+        embeddings_factor=embeddings_factor,
+    )
@@ -2,9 +2,12 @@ from datetime import datetime
 from typing import Optional
 
 from pgvector.sqlalchemy import Vector
+from sqlalchemy import ARRAY, Integer
 from sqlmodel import Column, Field, SQLModel
 
 from ..embedding import EMBEDDING_DIM
+from ..model_utils import defer_columns
+from ..vector_indexes import hnsw_index
 from .taste_categories import TASTE_KEYS
 
 
@@ -17,3 +20,17 @@ class UserBehavior(SQLModel, table=True):
     last_woocommerce_update: Optional[datetime] = None
     last_chatbot_update: Optional[datetime] = None
     is_onboarded: bool = Field(False)
+
+    __table_args__ = (
+        hnsw_index("userbehavior", "embedding"),
+        hnsw_index("userbehavior", "taste_embedding"),
+    )
+    __mapper_args__ = defer_columns("embedding")
+
+
+class PrecomputedRecommendation(SQLModel, table=True):
+    user_id: int = Field(primary_key=True)
+    item_type: str = Field(primary_key=True)  # table name, "product" or "producer"
+    item_ids: list[int] = Field(sa_column=Column(ARRAY(Integer)))
+    k: int
+    computed_at: datetime
@@ -0,0 +1,120 @@
+from datetime import datetime
+from typing import Type
+
+import numpy as np
+from loguru import logger
+from sqlalchemy.orm import joinedload
+from sqlmodel import SQLModel, select
+
+from ..db import TurriDB
+from ..update.jobs import report_progress
+from ..woocommerce.models import Product
+from .get_recommendations import CATEGORIES_FACTOR, EMBEDDINGS_FACTOR, MISSING_DISTANCE
+from .models import PrecomputedRecommendation, UserBehavior
+from .recommendation_index import RecommendationIndex
+
+PRECOMPUTED_K = 20
+USER_CHUNK_SIZE = 256
+
+
+async def precompute_recommendations(
+    db: TurriDB, k: int = PRECOMPUTED_K, chunk_size: int = USER_CHUNK_SIZE
+) -> int:
+    """
+    Computes the top k products and producers of every onboarded user and stores
+    them as PrecomputedRecommendation rows.
+
+    Users are scored against a freshly loaded catalog `chunk_size` at a time, each
+    chunk is a handful of matmuls followed by one upsert. Only requests for
+    exactly this k are served from them.
+
+    Returns:
+        int: Number of users that got recommendations.
+    """
+    index = RecommendationIndex()
+    await index.load(db)
+
+    statement = (
+        select(
+            UserBehavior.user_id, UserBehavior.taste_embedding, UserBehavior.embedding
+        )
+        .where(
+            UserBehavior.is_onboarded,
+            UserBehavior.taste_embedding.is_not(None),
+            UserBehavior.embedding.is_not(None),
+        )
+        .order_by(UserBehavior.user_id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    users = 0
+    async with db.session_maker() as session:
+        result = await session.stream(statement)
+        async for chunk in result.partitions():
+            user_ids = [row.user_id for row in chunk]
+            user_taste = np.asarray([row.taste_embedding for row in chunk], np.float32)
+            user_emb = np.asarray([row.embedding for row in chunk], np.float32)
+
+            computed_at = datetime.now()
+            rows = []
+            for model in RecommendationIndex.MODELS:
+                top_ids = index.top_k_ids_batch(
+                    model,
+                    user_taste,
+                    user_emb,
+                    k,
+                    CATEGORIES_FACTOR,
+                    EMBEDDINGS_FACTOR,
+                    MISSING_DISTANCE,
+                )
+                rows.extend(
+                    PrecomputedRecommendation(
+                        user_id=user_id,
+                        item_type=model.__tablename__,
+                        item_ids=item_ids,
+                        k=k,
+                        computed_at=computed_at,
+                    )
+                    for user_id, item_ids in zip(user_ids, top_ids)
+                )
+            await db.upsert_all(rows)
+            users += len(user_ids)
+            report_progress(len(user_ids))
+
+    logger.info(f"Precomputed recommendations for {users} users")
+    return users
+
+
+async def get_precomputed_recommendations(
+    db: TurriDB, user_id: int, model: Type[SQLModel], k: int
+) -> list[SQLModel] | None:
+    """
+    Returns the stored top k of `model` for the user, or None if nothing was
+    precomputed for this k, callers then fall back to the live search. A prefix
+    of a longer list is not the top k: the candidate lists depend on k.
+    """
+    precomputed: PrecomputedRecommendation = await db.query_table(
+        PrecomputedRecommendation,
+        where_clauses=[
+            PrecomputedRecommendation.user_id == user_id,
+            PrecomputedRecommendation.item_type == model.__tablename__,
+        ],
+        mode="first",
+    )
+    if precomputed is None or precomputed.k != k:
+        return None
+
+    top_ids = precomputed.item_ids
+    options = [joinedload(Product.producer)] if model is Product else None
+    rows = await db.get_many(model, top_ids, options=options)
+    return [rows[pid] for pid in top_ids if pid in rows]
+
+
+async def invalidate_precomputed_recommendations(db: TurriDB, user_id: int) -> None:
+    """
+    Drops the stored recommendations of the user, call it whenever their profile
+    embeddings change. The live search serves them until the next precompute.
+    """
+    await db.delete_where(
+        PrecomputedRecommendation, [PrecomputedRecommendation.user_id == user_id]
+    )
@@ -3,6 +3,7 @@ from datetime import datetime
 from ..db import TurriDB
 from ..embedding import compute_embeddings
 from .models import UserBehavior
+from .precompute_recommendations import invalidate_precomputed_recommendations
 
 
 async def process_onboarding(
@@ -22,3 +23,4 @@ async def process_onboarding(
         user_id=user_id,
     )
     await db.save(behaviour)
+    await invalidate_precomputed_recommendations(db, user_id)
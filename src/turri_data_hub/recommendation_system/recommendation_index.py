@@ -0,0 +1,262 @@
+from typing import Iterable, Type
+
+import numpy as np
+from loguru import logger
+from sqlmodel import SQLModel, select
+
+from ..db import STREAM_BATCH_SIZE, TurriDB
+from ..query_stats import record_query
+from ..woocommerce.models import Producer, Product
+from .models import UserBehavior
+
+
+def recommendable(model: Type[SQLModel]) -> list:
+    """
+    Where clauses of the rows that can be recommended. Trashed products stay in
+    the table only for the line items referencing them.
+    """
+    return [Product.status != "trash"] if model is Product else []
+
+
+class _ModelVectors:
+    """
+    Immutable snapshot of the vectors of one table, replaced as a whole on refresh
+    so concurrent searches never see a half updated matrix.
+    """
+
+    def __init__(self, ids: np.ndarray, taste: np.ndarray, emb: np.ndarray):
+        self.ids = ids
+        self.taste = taste
+        self.emb = emb
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _to_matrix(vectors: list, dim: int | None = None) -> np.ndarray:
+    """
+    Stacks vectors into a float64 matrix, missing vectors become rows of NaN.
+
+    float64 because `_l2_distances` expands the squared distance, in float32 the
+    terms cancel for near identical vectors.
+    """
+    if dim is None:
+        dim = next((len(v) for v in vectors if v is not None), 0)
+    matrix = np.full((len(vectors), dim), np.nan, dtype=np.float64)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            matrix[i] = vector
+    return matrix
+
+
+def _l2_distances(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    L2 distances between every query (rows) and every catalog row (columns) as
+    one matmul. Catalog rows without a vector get an infinite distance, so they
+    sort last like the NULL distances of the SQL query.
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    squared = (
+        (queries**2).sum(axis=1)[:, None]
+        + (matrix**2).sum(axis=1)[None, :]
+        - 2 * queries @ matrix.T
+    )
+    distances = np.sqrt(np.maximum(squared, 0))
+    return np.where(np.isnan(distances), np.inf, distances)
+
+
+def _nearest_mask(distances: np.ndarray, n: int) -> np.ndarray:
+    """
+    Marks the n smallest distances of every row. The columns are in id order, so
+    ties at the boundary go to the lowest ids, like ORDER BY distance, id.
+    """
+    if n >= distances.shape[1]:
+        return np.ones(distances.shape, dtype=bool)
+    kth = np.partition(distances, n - 1, axis=1)[:, n - 1 : n]
+    mask = distances < kth
+    ties = distances == kth
+    needed = n - mask.sum(axis=1, keepdims=True)
+    return mask | (ties & (np.cumsum(ties, axis=1) <= needed))
+
+
+def hybrid_top_k_batch(
+    ids: np.ndarray,
+    taste: np.ndarray,
+    emb: np.ndarray,
+    user_taste: np.ndarray,
+    user_emb: np.ndarray,
+    k: int,
+    categories_factor: float,
+    embeddings_factor: float,
+    missing_distance: float,
+) -> list[list[int]]:
+    """
+    Hybrid top k for many users at once, one row of `user_taste`/`user_emb` per user.
+    `ids` must be sorted, ties are broken by id.
+
+    Same scoring as the SQL query in `get_recommendations`: the k*3 nearest rows
+    per embedding are candidates, a distance missing from one of the two candidate
+    lists, or a candidate without a vector, counts as `missing_distance`.
+    """
+    if not len(ids) or k <= 0:
+        return [[] for _ in range(len(user_taste))]
+
+    taste_distances = _l2_distances(taste, user_taste)
+    emb_distances = _l2_distances(emb, user_emb)
+    in_taste = _nearest_mask(taste_distances, k * 3)
+    in_emb = _nearest_mask(emb_distances, k * 3)
+
+    taste_scores = np.where(
+        in_taste & np.isfinite(taste_distances), taste_distances, missing_distance
+    )
+    emb_scores = np.where(
+        in_emb & np.isfinite(emb_distances), emb_distances, missing_distance
+    )
+    scores = categories_factor * taste_scores + embeddings_factor * emb_scores
+    scores[~(in_taste | in_emb)] = np.inf
+
+    top = _nearest_mask(scores, min(k, len(ids))) & np.isfinite(scores)
+    results = []
+    for row in range(len(scores)):
+        positions = np.flatnonzero(top[row])
+        order = np.lexsort((ids[positions], scores[row, positions]))
+        results.append([int(pid) for pid in ids[positions[order]]])
+    return results
+
+
+class RecommendationIndex:
+    """
+    In-memory copy of the taste and semantic embeddings of products and producers.
+
+    Ranks with the same hybrid scoring as the SQL query in `get_recommendations`,
+    see `hybrid_top_k_batch`. Only ids are ranked here, the rows themselves are
+    fetched by primary key so they are never stale.
+    """
+
+    MODELS = (Product, Producer)
+
+    def __init__(self):
+        self._vectors: dict[Type[SQLModel], _ModelVectors] = {}
+
+    def is_ready(self, model: Type[SQLModel]) -> bool:
+        return model in self._vectors
+
+    async def _fetch_vectors(
+        self, db: TurriDB, model: Type[SQLModel], ids: Iterable[int] | None = None
+    ) -> tuple[list[int], list, list]:
+        statement = select(model.id, model.taste_embedding, model.embedding).where(
+            *recommendable(model)
+        )
+        if ids is not None:
+            statement = statement.where(model.id.in_(ids))
+        statement = statement.order_by(model.id).execution_options(
+            yield_per=STREAM_BATCH_SIZE
+        )
+
+        ids_out, taste, emb = [], [], []
+        with record_query("load_vectors", statement) as record:
+            async with db.session_maker() as session:
+                result = await session.stream(statement)
+                async for row_id, taste_embedding, embedding in result:
+                    ids_out.append(row_id)
+                    taste.append(taste_embedding)
+                    emb.append(embedding)
+            record.rows = len(ids_out)
+        return ids_out, taste, emb
+
+    async def load(self, db: TurriDB) -> None:
+        """
+        (Re)loads all vectors of products and producers.
+        """
+        for model in self.MODELS:
+            ids, taste, emb = await self._fetch_vectors(db, model)
+            self._vectors[model] = _ModelVectors(
+                np.asarray(ids, dtype=np.int64), _to_matrix(taste), _to_matrix(emb)
+            )
+            logger.info(f"Recommendation index loaded {len(ids)} {model.__name__}s")
+
+    async def refresh(self, db: TurriDB, model: Type[SQLModel], ids: list[int]) -> None:
+        """
+        Reloads the vectors of the given rows only, e.g. after their taste
+        embeddings were recomputed. Unknown ids are added, ids that no longer
+        exist or are no longer `recommendable` are dropped. Does nothing while
+        the index is cold.
+        """
+        current = self._vectors.get(model)
+        if current is None or not ids:
+            return
+
+        fresh_ids, taste, emb = await self._fetch_vectors(db, model, ids)
+        stale = set(ids) - set(fresh_ids)
+        keep = ~np.isin(current.ids, list(stale))
+
+        all_ids = current.ids[keep].copy()
+        all_taste = current.taste[keep].copy()
+        all_emb = current.emb[keep].copy()
+        positions = {int(pid): i for i, pid in enumerate(all_ids)}
+
+        new_taste = _to_matrix(taste, current.taste.shape[1])
+        new_emb = _to_matrix(emb, current.emb.shape[1])
+        appended = []
+        for i, pid in enumerate(fresh_ids):
+            if pid in positions:
+                all_taste[positions[pid]] = new_taste[i]
+                all_emb[positions[pid]] = new_emb[i]
+            else:
+                appended.append(i)
+
+        all_ids = np.concatenate(
+            [all_ids, np.asarray(fresh_ids, dtype=np.int64)[appended]]
+        )
+        # Keep the rows in id order, `hybrid_top_k_batch` breaks ties by position
+        order = np.argsort(all_ids, kind="stable")
+        self._vectors[model] = _ModelVectors(
+            all_ids[order],
+            np.concatenate([all_taste, new_taste[appended]])[order],
+            np.concatenate([all_emb, new_emb[appended]])[order],
+        )
+
+    def top_k_ids(
+        self,
+        model: Type[SQLModel],
+        user: UserBehavior,
+        k: int,
+        categories_factor: float,
+        embeddings_factor: float,
+        missing_distance: float,
+    ) -> list[int]:
+        return self.top_k_ids_batch(
+            model,
+            np.asarray([user.taste_embedding], dtype=np.float32),
+            np.asarray([user.embedding], dtype=np.float32),
+            k,
+            categories_factor,
+            embeddings_factor,
+            missing_distance,
+        )[0]
+
+    def top_k_ids_batch(
+        self,
+        model: Type[SQLModel],
+        user_taste: np.ndarray,
+        user_emb: np.ndarray,
+        k: int,
+        categories_factor: float,
+        embeddings_factor: float,
+        missing_distance: float,
+    ) -> list[list[int]]:
+        vectors = self._vectors[model]
+        return hybrid_top_k_batch(
+            vectors.ids,
+            vectors.taste,
+            vectors.emb,
+            user_taste,
+            user_emb,
+            k,
+            categories_factor,
+            embeddings_factor,
+            missing_distance,
+        )
+
+
+recommendation_index = RecommendationIndex()
@@ -13,6 +13,7 @@ from src.agents.utils import gemini_only_text
 from src.turri_data_hub.settings import GoogleCloudSettings, WoocommerceSettings
 
 from ..db import TurriDB
+from ..update.jobs import report_job_error, report_progress
 from ..woocommerce.models import Producer, Product, ProductCategory
 from .taste_categories import TASTE_KEYS
 from .update_profile import update_user_profile
@@ -186,14 +187,19 @@ async def update_customer_profiles_based_on_analytics(
         df = await fetch_user_page_activity(from_date=from_date)
     except Exception as e:
         logger.error(f"big query query failed with {e}")
+        report_job_error(f"big query query failed with {e}")
         return 0, 0
 
-    for user_id, group in tqdm(df.groupby("user_id")):
+    groups = df.groupby("user_id")
+    report_progress(0, total=groups.ngroups)
+    for user_id, group in tqdm(groups):
         try:
             await update_customer(db=db, customer_id=int(user_id), group=group)
             success += 1
         except Exception as e:
             logger.exception(f"Failed to update customer profile because of {e}")
+            report_job_error(f"customer {user_id}: {e}")
             failures += 1
+        report_progress()
 
     return success, failures
@@ -9,6 +9,7 @@ from src.agents.utils import gemini_only_text
 from ..db import TurriDB
 from ..embedding import compute_embeddings
 from .models import UserBehavior
+from .precompute_recommendations import invalidate_precomputed_recommendations
 
 ALPHA = 0.8
 
@@ -60,6 +61,7 @@ async def update_user_profile(
             **date_kwargs,
         )
         await db.save(profile)
+        await invalidate_precomputed_recommendations(db, user_id)
         return
 
     old_description = profile.description
@@ -90,3 +92,4 @@ async def update_user_profile(
     setattr(profile, source_to_keys[source], datetime.now())
 
     await db.save(profile)
+    await invalidate_precomputed_recommendations(db, user_id)
@@ -9,6 +9,7 @@ from tqdm import tqdm
 from src.agents.utils import gemini_only_text
 
 from ..db import TurriDB
+from ..update.jobs import report_job_error, report_progress
 from ..woocommerce.models import Order, Product
 from .taste_categories import TASTE_KEYS
 from .update_profile import update_user_profile
@@ -24,21 +25,22 @@ async def update_customer(db: TurriDB, from_date: datetime, customer_id: int):
         options=[selectinload(Order.line_items)],
     )
 
+    products: dict[int, Product] = await db.get_many(
+        Product,
+        [item.product_id for order in orders for item in order.line_items],
+        options=[
+            selectinload(Product.producer),
+            selectinload(Product.categories),
+            selectinload(Product.tags),
+        ],
+    )
+
     taste_embeddings = []
     text = ""
 
     for order in orders:
         for item in order.line_items:
-            product: Product = await db.query_table(
-                Product,
-                where_clauses=[Product.id == item.product_id],
-                mode="first",
-                options=[
-                    selectinload(Product.producer),
-                    selectinload(Product.categories),
-                    selectinload(Product.tags),
-                ],
-            )
+            product = products.get(item.product_id)
             if not product:
                 logger.info(f"Could not get product {item.product_id}")
                 continue
@@ -82,14 +84,21 @@ async def update_customer(db: TurriDB, from_date: datetime, customer_id: int):
 async def update_customer_profiles_based_on_orders(
     db: TurriDB, from_date: datetime
 ) -> tuple[int, int]:
-    # could be optmized by sql query directly
-    orders_since_then = await db.query_table(
-        Order, where_clauses=[Order.date_created > from_date]
-    )
-    customers = {order.customer_id for order in orders_since_then}
+    customers = set()
+    # guest orders have no customer to build a profile for
+    async for orders in db.stream_table(
+        Order,
+        where_clauses=[
+            Order.date_created > from_date,
+            Order.customer_id.is_not(None),
+        ],
+    ):
+        customers.update(order.customer_id for order in orders)
+    customers.discard(None)
 
     success = 0
     failures = 0
+    report_progress(0, total=len(customers))
 
     for customer_id in tqdm(customers):
         try:
@@ -97,6 +106,8 @@ async def update_customer_profiles_based_on_orders(
             success += 1
         except Exception as e:
             logger.exception(f"Failed to update customer profile because of {e}")
+            report_job_error(f"customer {customer_id}: {e}")
             failures += 1
+        report_progress()
 
     return success, failures
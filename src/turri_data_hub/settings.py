@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
@@ -11,6 +12,36 @@ class WoocommerceSettings(BaseSettings):
     url: str = "https://turri.cr"
     WOOCOMERCE_CLIENT_KEY: str
     WOOCOMERCE_SECRET_KEY: str
+    # Pooled connections to the shop and how many list pages are fetched at once
+    http_max_connections: int = 10
+    http_timeout_s: float = 30
+    page_concurrency: int = 4
+    # Requests in flight adapt between 1 and http_max_connections: they back off
+    # on throttling, server errors and responses slower than the target latency
+    http_initial_concurrency: int = 4
+    http_target_latency_s: float = 5
+    # Retries of failed GETs, with jittered exponential backoff or Retry-After
+    http_max_retries: int = 5
+    http_backoff_base_s: float = 1
+    http_backoff_max_s: float = 60
+    # Sync pipelines: pages buffered between stages and workers of the CPU bound
+    # HTML-to-text and the database stages
+    pipeline_queue_size: int = 4
+    transform_concurrency: int = 2
+    upsert_concurrency: int = 2
+    # Independent steps of a sync that may run at the same time
+    sync_max_concurrent_steps: int = 3
+    # Incremental syncs re-fetch this much before the watermark to absorb clock and
+    # timezone differences, every full_sync_interval_days a full pass is made
+    sync_overlap_hours: float = 24
+    full_sync_interval_days: float = 7
+    # Records failing this often stop being retried and holding back the watermark
+    sync_max_failure_attempts: int = 5
+    # Secret of the shop's webhooks, webhook deliveries are rejected without it
+    WOOCOMMERCE_WEBHOOK_SECRET: str | None = None
+    webhook_queue_size: int = 1000
+    # How long shutdown waits for queued webhooks before recording them as failures
+    webhook_drain_timeout_s: float = 20
 
 
 class GoogleCloudSettings(BaseSettings):
@@ -21,12 +52,32 @@ class GoogleCloudSettings(BaseSettings):
 class DataBaseSettings(BaseSettings):
     GOOGLE_API_KEY: str
     embedding_model: str = "models/text-embedding-004"
+    # "gemini" uses embedding_model, "hashing" is a deterministic offline backend
+    # for tests and benchmarks
+    embedding_backend: Literal["gemini", "hashing"] = "gemini"
+    # Texts per embed request (the provider's limit), how long to wait for more
+    # texts before sending a batch, and how many batches may be in flight
+    embedding_batch_size: int = 100
+    embedding_batch_window_ms: float = 10
+    embedding_max_concurrency: int = 4
+    # Retries of a rate limited or failing embed request, with full jitter backoff
+    embedding_max_retries: int = 5
+    embedding_backoff_base_s: float = 1
+    embedding_backoff_max_s: float = 60
+    # Cache of the chat agents' search query embeddings, optionally shared via Redis
+    query_embedding_cache_size: int = 2048
+    query_embedding_cache_ttl_s: float = 7 * 24 * 3600
+    query_embedding_cache_redis_url: str | None = None
     POSTGRES_HOST: str
     POSTGRES_PORT: str
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_NAME: str
     DB_CONNECTION_NAME: str | None = None
+    slow_query_ms: float = 250
+    n_plus_one_threshold: int = 5
+    # HNSW candidate list size for the RAG chat tools, None keeps pgvector's default
+    rag_ef_search: int | None = None
 
     def get_postgres_dsn(self, driver_name: str = "asyncpg") -> str:
         if self.DB_CONNECTION_NAME:
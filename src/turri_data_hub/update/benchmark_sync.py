@@ -0,0 +1,140 @@
+"""
+Runs `fetch_all_wocommerce_data` against recorded fixtures and reports the
+records per second of every step.
+
+    EMBEDDING_BACKEND=hashing python -m src.turri_data_hub.update.benchmark_sync \\
+        woocommerce_fixtures --latency-ms 150 --scale products=10 --scale orders=10
+
+The shop is replaced by the in-process replay app of `woocommerce.replay`, the
+database is the configured one, so point it at a scratch database. Use the
+hashing embedding backend unless the embedding provider is part of what you
+measure.
+"""
+
+import argparse
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+from loguru import logger
+
+from src.turri_data_hub.embedding import GeminiEmbeddingBackend, embedding_service
+from src.turri_data_hub.query_stats import query_scope
+from src.turri_data_hub.update.fetch_all_woocommerce import fetch_all_wocommerce_data
+from src.turri_data_hub.woocommerce.fetch.utils import woocommerce_client
+from src.turri_data_hub.woocommerce.replay import (
+    FixtureStore,
+    create_replay_app,
+    parse_scale,
+)
+
+# The collection whose records each sync step processes
+STEP_COLLECTIONS = {
+    "tags": "tags",
+    "categories": "categories",
+    "producers": "producers",
+    "products": "products",
+    "customers": "customers",
+    "orders": "orders",
+    "product_tastes": "products",
+    "producer_tastes": "producers",
+}
+
+
+async def run_benchmark(
+    fixtures_dir: Path,
+    scale: dict[str, int] | None = None,
+    latency_ms: float = 0,
+    latency_jitter_ms: float = 0,
+    max_in_flight: int | None = None,
+) -> dict:
+    """
+    Makes a full sync from the replayed shop.
+
+    Returns:
+        dict: Records, seconds and records/sec per step, the DAG timings, and the
+            request counts of the client and the replay server.
+    """
+    store = FixtureStore(fixtures_dir, scale)
+    app = create_replay_app(
+        store,
+        latency_ms=latency_ms,
+        latency_jitter_ms=latency_jitter_ms,
+        max_in_flight=max_in_flight,
+    )
+    await woocommerce_client.use_transport(httpx.ASGITransport(app=app))
+    try:
+        with query_scope("benchmark_sync") as db_stats:
+            summary = await fetch_all_wocommerce_data(full=True, resume=False)
+    finally:
+        await woocommerce_client.use_transport(None)
+
+    steps = {}
+    for name, step in summary["steps"].items():
+        records = store.count(STEP_COLLECTIONS[name])
+        steps[name] = {
+            "records": records,
+            "elapsed_s": step["elapsed_s"],
+            "records_per_s": (
+                round(records / step["elapsed_s"], 1) if step["elapsed_s"] else None
+            ),
+        }
+    return {
+        "embedding_model": embedding_service.backend.model,
+        "scale": store.scale,
+        "latency_ms": latency_ms,
+        "steps": steps,
+        "dag": summary,
+        "client": woocommerce_client.stats(),
+        "server": app.state.stats,
+        "db": db_stats.summary(top=5),
+    }
+
+
+def log_report(report: dict) -> None:
+    lines = [f"{'step':<16}{'records':>10}{'seconds':>10}{'records/s':>12}"]
+    for name, step in report["steps"].items():
+        lines.append(
+            f"{name:<16}{step['records']:>10}{step['elapsed_s']:>10.2f}"
+            f"{step['records_per_s'] or 0:>12.1f}"
+        )
+    dag = report["dag"]
+    lines.append(
+        f"wall {dag['wall_s']}s, critical path {dag['critical_path_s']}s "
+        f"({' -> '.join(dag['critical_path'])}), "
+        f"{report['server']['requests']} requests, "
+        f"{report['client']['retries']} retries"
+    )
+    logger.info("Sync benchmark\n" + "\n".join(lines))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--scale", action="append", default=[], metavar="NAME=N")
+    parser.add_argument("--output", type=Path, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    if isinstance(embedding_service.backend, GeminiEmbeddingBackend):
+        logger.warning("Benchmarking with the Gemini backend, set EMBEDDING_BACKEND")
+
+    report = asyncio.run(
+        run_benchmark(
+            args.fixtures,
+            scale=parse_scale(args.scale),
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            max_in_flight=args.max_in_flight,
+        )
+    )
+    log_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
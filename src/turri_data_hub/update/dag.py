@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from loguru import logger
+
+
+class Step:
+    """
+    One node of a Dag, `func` runs once all steps named in `after` succeeded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        after: Iterable[str] = (),
+    ):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        # "pending", "running", "succeeded", "failed" or "skipped"
+        self.status = "pending"
+        self.ready_s: float | None = None
+        self.start_s: float | None = None
+        self.elapsed_s = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "status": self.status,
+            "after": list(self.after),
+            "start_s": round(self.start_s, 2) if self.start_s is not None else None,
+            # time spent waiting for the concurrency budget
+            "queued_s": (
+                round(self.start_s - self.ready_s, 2)
+                if self.start_s is not None
+                else None
+            ),
+            "elapsed_s": round(self.elapsed_s, 2),
+        }
+
+
+class Dag:
+    """
+    Runs steps as soon as their prerequisites are done, at most `max_concurrency`
+    at a time, so the wall time approaches the critical path instead of the sum
+    of all steps.
+
+    A failed step skips the steps depending on it, independent ones still run.
+    The first failure is raised once nothing runs anymore.
+    """
+
+    def __init__(self, name: str, steps: list[Step], max_concurrency: int = 3):
+        self.name = name
+        self.steps = {step.name: step for step in steps}
+        self.max_concurrency = max_concurrency
+        self.wall_s = 0.0
+        if len(self.steps) != len(steps):
+            raise ValueError(f"Dag '{name}' has duplicate step names")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list[str]:
+        for step in self.steps.values():
+            unknown = set(step.after) - set(self.steps)
+            if unknown:
+                raise ValueError(f"Step '{step.name}' depends on unknown {unknown}")
+
+        order: list[str] = []
+        remaining = {name: set(step.after) for name, step in self.steps.items()}
+        while remaining:
+            ready = [name for name, after in remaining.items() if not after]
+            if not ready:
+                raise ValueError(f"Dag '{self.name}' has a cycle in {set(remaining)}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for after in remaining.values():
+                after.difference_update(ready)
+        return order
+
+    async def run(self) -> dict:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        finished = {name: asyncio.Event() for name in self.steps}
+        errors: list[Exception] = []
+        start = time.perf_counter()
+
+        async def run_step(step: Step) -> None:
+            try:
+                for name in step.after:
+                    await finished[name].wait()
+                if any(self.steps[name].status != "succeeded" for name in step.after):
+                    step.status = "skipped"
+                    logger.warning(
+                        f"Skipping step '{step.name}', a prerequisite failed"
+                    )
+                    return
+                step.ready_s = time.perf_counter() - start
+                async with semaphore:
+                    step.start_s = time.perf_counter() - start
+                    step.status = "running"
+                    try:
+                        await step.func()
+                        step.status = "succeeded"
+                    except Exception as e:
+                        step.status = "failed"
+                        errors.append(e)
+                        logger.exception(f"Step '{step.name}' of '{self.name}' failed")
+                    finally:
+                        step.elapsed_s = time.perf_counter() - start - step.start_s
+            finally:
+                finished[step.name].set()
+
+        await asyncio.gather(*(run_step(self.steps[name]) for name in self.order))
+        self.wall_s = time.perf_counter() - start
+
+        summary = self.summary()
+        logger.info(
+            f"Dag '{self.name}' took {self.wall_s:.1f}s (critical path "
+            f"{summary['critical_path_s']}s: {' -> '.join(summary['critical_path'])}), "
+            + ", ".join(
+                f"{name} {step.elapsed_s:.1f}s" for name, step in self.steps.items()
+            )
+        )
+        if errors:
+            raise errors[0]
+        return summary
+
+    def critical_path(self) -> tuple[list[str], float]:
+        """
+        The chain of dependent steps with the longest total run time.
+        """
+        longest: dict[str, tuple[float, list[str]]] = {}
+        for name in self.order:
+            step = self.steps[name]
+            before = max(
+                (longest[dep] for dep in step.after),
+                key=lambda entry: entry[0],
+                default=(0.0, []),
+            )
+            longest[name] = (before[0] + step.elapsed_s, [*before[1], name])
+        total, path = max(longest.values(), key=lambda entry: entry[0])
+        return path, total
+
+    def summary(self) -> dict:
+        path, total = self.critical_path()
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall_s, 2),
+            "critical_path": path,
+            "critical_path_s": round(total, 2),
+            "steps": {name: self.steps[name].summary() for name in self.order},
+        }
@@ -1,10 +1,23 @@
-from sqlalchemy.orm import selectinload
+import asyncio
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Awaitable, Callable
+
+from loguru import logger
 
 from src.turri_data_hub.db import TurriDB
 from src.turri_data_hub.recommendation_system.compute_taste_embeddings import (
-    get_producer_taste_embeddings,
-    get_product_taste_embeddings,
+    update_producer_tastes,
+    update_product_tastes,
+)
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    recommendation_index,
 )
+from src.turri_data_hub.settings import WoocommerceSettings
+from src.turri_data_hub.update.dag import Dag, Step
+from src.turri_data_hub.update.jobs import report_progress
+from src.turri_data_hub.update.models import SyncFailure, SyncState
+from src.turri_data_hub.update.sync_state import Watermark
 from src.turri_data_hub.woocommerce.fetch import (
     fetch_create_and_save_categories,
     fetch_create_and_save_customers,
@@ -15,36 +28,287 @@ from src.turri_data_hub.woocommerce.fetch import (
 )
 from src.turri_data_hub.woocommerce.models import Producer, Product
 
+# Failed records are re-fetched by id, at most this many per request
+RETRY_CHUNK_SIZE = 100
+
 
 async def calc_for_products(db: TurriDB):
-    products: list[Product] = await db.query_table(
-        Product, options=[selectinload(Product.tags), selectinload(Product.categories)]
+    """
+    Recomputes the product taste embeddings, only the changed ones are written
+    and reloaded into the recommendation index. The sync pipelines already
+    reloaded every product they saved.
+    """
+    changed = await update_product_tastes(db)
+    await recommendation_index.refresh(db, Product, changed)
+    logger.info(f"Taste embeddings of {len(changed)} products changed")
+
+
+async def calc_for_producers(db: TurriDB):
+    """
+    Sets the producer taste embeddings to the average of their products', in
+    one UPDATE, see `update_producer_tastes`.
+    """
+    changed = await update_producer_tastes(db)
+    await recommendation_index.refresh(db, Producer, changed)
+    logger.info(f"Taste embeddings of {len(changed)} producers changed")
+
+
+class FailureList:
+    """
+    The SyncFailure rows of one resource, updated from what a Watermark saw.
+    `attempts` counts the failures of each record so far.
+    """
+
+    def __init__(self, resource: str, attempts: dict[int, int]):
+        self.resource = resource
+        self.attempts = attempts
+
+    @property
+    def ids(self) -> set[int]:
+        return set(self.attempts)
+
+    @classmethod
+    async def load(cls, db: TurriDB, resource: str) -> "FailureList":
+        failures = await db.query_table(
+            SyncFailure, where_clauses=[SyncFailure.resource == resource]
+        )
+        return cls(resource, {f.entity_id: f.attempts for f in failures})
+
+    def retryable(self, max_attempts: int) -> list[int]:
+        """
+        The failed records that are not dead-lettered yet.
+        """
+        return sorted(
+            entity_id
+            for entity_id, attempts in self.attempts.items()
+            if attempts < max_attempts
+        )
+
+    async def flush(
+        self, db: TurriDB, watermark: Watermark, gone: set[int] = frozenset()
+    ) -> None:
+        """
+        Stores the watermark's new failures and drops the records that succeeded
+        since or no longer exist (`gone`).
+        """
+        failures, watermark.failures = watermark.failures, {}
+        succeeded, watermark.succeeded = watermark.succeeded, set()
+        now = datetime.now()
+        if failures:
+            for entity_id in failures:
+                self.attempts[entity_id] = self.attempts.get(entity_id, 0) + 1
+            await db.upsert_all(
+                [
+                    SyncFailure(
+                        resource=self.resource,
+                        entity_id=entity_id,
+                        error=error,
+                        failed_at=now,
+                        attempts=self.attempts[entity_id],
+                    )
+                    for entity_id, error in failures.items()
+                ]
+            )
+
+        resolved = (succeeded | gone) & self.ids
+        if resolved:
+            await db.delete_where(
+                SyncFailure,
+                [
+                    SyncFailure.resource == self.resource,
+                    SyncFailure.entity_id.in_(resolved),
+                ],
+            )
+            for entity_id in resolved:
+                del self.attempts[entity_id]
+
+
+async def retry_failures(
+    db: TurriDB,
+    failures: FailureList,
+    fetch: Callable[..., Awaitable[Watermark]],
+) -> None:
+    max_attempts = WoocommerceSettings().sync_max_failure_attempts
+    ids = failures.retryable(max_attempts)
+    dead = len(failures.attempts) - len(ids)
+    logger.info(
+        f"Retrying {len(ids)} failed {failures.resource}"
+        + (f", {dead} dead-lettered" if dead else "")
     )
+    for start in range(0, len(ids), RETRY_CHUNK_SIZE):
+        chunk = ids[start : start + RETRY_CHUNK_SIZE]
+        watermark = await fetch(
+            db,
+            watermark=Watermark(attempts=failures.attempts, max_attempts=max_attempts),
+            include=chunk,
+        )
+        gone = set(chunk) - watermark.succeeded - set(watermark.failures)
+        await failures.flush(db, watermark, gone=gone)
 
-    for product in products:
-        product.taste_embedding = get_product_taste_embeddings(product)
-        await db.save(product)
 
+async def sync_resource(
+    db: TurriDB,
+    state: SyncState,
+    fetch: Callable[..., Awaitable[Watermark]],
+) -> None:
+    """
+    Runs one list fetch step from the watermark stored in its SyncState.
 
-async def calc_for_producers(db: TurriDB):
-    producers: list[Producer] = await db.query_table(
-        Producer, options=[selectinload(Producer.products)]
+    Every finished page checkpoints the page to resume from, the watermark so far
+    and the records that failed. Failures of earlier runs are retried first.
+    """
+    failures = await FailureList.load(db, state.resource)
+    if failures.ids and state.run_checkpoint is None and not state.run_full:
+        await retry_failures(db, failures, fetch)
+
+    watermark = Watermark(
+        None if state.run_full else state.watermark,
+        start_page=state.run_checkpoint or 1,
+        attempts=failures.attempts,
+        max_attempts=WoocommerceSettings().sync_max_failure_attempts,
     )
+    watermark.newest_ok = state.run_newest_ok
+    watermark.oldest_failed = state.run_oldest_failed
+    lock = asyncio.Lock()
 
-    for producer in producers:
-        producer.taste_embedding = get_producer_taste_embeddings(producer)
-        await db.save(producer)
+    async def checkpoint(watermark: Watermark) -> None:
+        # pages finish concurrently, saves must not overtake each other
+        async with lock:
+            state.run_checkpoint = watermark.resume_page
+            state.run_newest_ok = watermark.newest_ok
+            state.run_oldest_failed = watermark.oldest_failed
+            await failures.flush(db, watermark)
+            await db.save(state)
 
+    watermark.on_checkpoint = checkpoint
 
-async def fetch_all_wocommerce_data():
+    logger.info(
+        f"Syncing {state.resource} "
+        + ("(full" if state.run_full else f"(modified since {state.watermark})")
+        + (f", from page {watermark.start_page})" if watermark.start_page > 1 else ")")
+    )
+    await fetch(db, watermark=watermark)
+    await failures.flush(db, watermark)
+
+    state.watermark = watermark.value
+    state.last_run = state.run_started_at
+    if state.run_full:
+        state.last_full_sync = state.run_started_at
+
+
+# The steps of a sync, each checkpoints to the SyncState of its name
+SYNC_STEPS: dict[str, Callable[[TurriDB, SyncState], Awaitable[None]]] = {
+    "tags": lambda db, state: fetch_create_and_save_tags(db),
+    "categories": lambda db, state: fetch_create_and_save_categories(db),
+    "producers": partial(sync_resource, fetch=fetch_generate_and_save_producers),
+    "products": partial(sync_resource, fetch=fetch_generate_and_save_products),
+    "customers": partial(sync_resource, fetch=fetch_create_and_save_customers),
+    "orders": partial(sync_resource, fetch=fetch_create_and_save_orders),
+    "product_tastes": lambda db, state: calc_for_products(db),
+    "producer_tastes": lambda db, state: calc_for_producers(db),
+}
+
+# Steps that must have finished before a step starts, the others run concurrently
+SYNC_PREREQUISITES: dict[str, tuple[str, ...]] = {
+    # references are looked up once at the start of the step
+    "products": ("tags", "categories", "producers"),
+    "orders": ("customers",),
+    "product_tastes": ("products",),
+    "producer_tastes": ("producers", "product_tastes"),
+}
+
+
+async def start_or_resume_run(
+    db: TurriDB, full: bool | None, resume: bool
+) -> dict[str, SyncState]:
+    """
+    Returns the SyncStates of all steps, of the interrupted run if there is one
+    and `resume` is set, otherwise of a new run.
+
+    `full=None` makes a full pass of a resource if none was made for
+    `full_sync_interval_days`, which reconciles anything an incremental run missed.
+    """
+    states = {
+        state.resource: state
+        for state in await db.query_table(
+            SyncState, where_clauses=[SyncState.resource.in_(SYNC_STEPS)]
+        )
+    }
+    now = datetime.now()
+    started = [s.run_started_at for s in states.values() if s.run_started_at]
+    if resume and started:
+        logger.info(f"Resuming the sync started at {min(started).isoformat()}")
+        for step in SYNC_STEPS:
+            states.setdefault(step, SyncState(resource=step, run_started_at=now))
+        return states
+
+    interval = timedelta(days=WoocommerceSettings().full_sync_interval_days)
+    for step in SYNC_STEPS:
+        state = states.setdefault(step, SyncState(resource=step))
+        state.run_started_at = now
+        state.run_done = False
+        state.run_checkpoint = None
+        state.run_newest_ok = None
+        state.run_oldest_failed = None
+        state.run_full = (
+            full
+            if full is not None
+            else (
+                state.watermark is None
+                or state.last_full_sync is None
+                or now - state.last_full_sync > interval
+            )
+        )
+    await db.upsert_all(list(states.values()))
+    return states
+
+
+async def fetch_all_wocommerce_data(
+    full: bool | None = None, resume: bool = True
+) -> dict:
+    """
+    Syncs the shop. Tags and categories are always fetched completely (one request
+    each), everything else incrementally, see `sync_resource`. Steps run as soon
+    as their SYNC_PREREQUISITES are done, at most `sync_max_concurrent_steps` at
+    a time.
+
+    A run that failed midway is resumed by the next one: finished steps are
+    skipped, the others continue from their last checkpoint. `resume=False`
+    discards it and starts over.
+
+    Returns:
+        dict: Timings of the steps, see `Dag.summary`.
+    """
     db = TurriDB()
     await db.initialize_db()
-    await fetch_create_and_save_tags(db)
-    await fetch_create_and_save_categories(db)
-    await fetch_generate_and_save_producers(db)
-    await fetch_generate_and_save_products(db)
-    await fetch_create_and_save_customers(db)
-    await fetch_create_and_save_orders(db)
-
-    await calc_for_products(db)
-    await calc_for_producers(db)
+    states = await start_or_resume_run(db, full, resume)
+    report_progress(0, total=len(SYNC_STEPS))
+
+    async def run_step(step: str) -> None:
+        state = states[step]
+        if state.run_done:
+            logger.info(f"Skipping {step}, done before the run was interrupted")
+        else:
+            await SYNC_STEPS[step](db, state)
+            state.run_done = True
+            state.run_checkpoint = None
+            await db.save(state)
+        report_progress()
+
+    dag = Dag(
+        "woocommerce",
+        [
+            Step(step, partial(run_step, step), SYNC_PREREQUISITES.get(step, ()))
+            for step in SYNC_STEPS
+        ],
+        max_concurrency=WoocommerceSettings().sync_max_concurrent_steps,
+    )
+    summary = await dag.run()
+
+    for state in states.values():
+        state.run_started_at = None
+        state.run_done = False
+        state.run_newest_ok = None
+        state.run_oldest_failed = None
+    await db.upsert_all(list(states.values()))
+    return summary
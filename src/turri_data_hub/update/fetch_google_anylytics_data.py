@@ -14,6 +14,7 @@ from src.turri_data_hub.google_analytics.fetch import (
     get_unique_users_and_regions,
 )
 from src.turri_data_hub.google_analytics.models import PageGoogleAnalyticsData
+from src.turri_data_hub.update.jobs import report_job_error, report_progress
 from src.turri_data_hub.woocommerce.models import Producer, Product
 
 
@@ -55,7 +56,7 @@ async def fetch_for_producer(db: TurriDB, producer: Producer):
         product_pages = await asyncio.gather(
             *[fetch_for_product(product, producer.id) for product in producer.products]
         )
-        await db.save_all(product_pages)
+        await db.upsert_all(product_pages)
     except Exception as e:
         logger.error(
             f"Error fetching or saving product pages for producer {producer.id}: {e}"
@@ -63,12 +64,13 @@ async def fetch_for_producer(db: TurriDB, producer: Producer):
 
 
 async def fetch_google_analytics_data(db: TurriDB):
-    producers = await db.query_table(
+    async for producers in db.stream_table(
         Producer, options=[selectinload(Producer.products)]
-    )
-
-    for p in tqdm(producers):
-        try:
-            await fetch_for_producer(db, p)
-        except Exception as e:
-            logger.error(f"Error processing producer {p.id}: {e}")
+    ):
+        for p in tqdm(producers):
+            try:
+                await fetch_for_producer(db, p)
+            except Exception as e:
+                logger.error(f"Error processing producer {p.id}: {e}")
+                report_job_error(f"producer {p.id}: {e}")
+            report_progress()
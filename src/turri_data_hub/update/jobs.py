@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+
+from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.query_stats import query_scope
+from src.turri_data_hub.update.models import Job
+
+HEARTBEAT_INTERVAL_S = 15
+# a running job whose heartbeat is older than this is considered dead
+STALE_AFTER_S = 120
+MAX_JOB_ERRORS = 100
+
+_current_job: ContextVar[Job | None] = ContextVar("current_job", default=None)
+
+
+def report_progress(done: int = 1, total: int | None = None) -> None:
+    """
+    Advances the progress of the job the caller runs in, does nothing outside
+    of a job. `total` sets the number of units once it is known.
+    """
+    if job := _current_job.get():
+        job.done += done
+        if total is not None:
+            job.total = total
+
+
+def report_job_error(message: str) -> None:
+    """
+    Records a failed unit of work of the current job, which keeps running.
+    """
+    job = _current_job.get()
+    if job is not None and len(job.errors) < MAX_JOB_ERRORS:
+        job.errors = [*job.errors, message]
+
+
+class JobAlreadyRunning(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Job '{name}' is already running")
+        self.name = name
+
+
+class JobRunner:
+    """
+    Runs admin jobs as background tasks, persisting their status, progress and
+    errors in the Job table. A job name can't run twice at the same time.
+    """
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    async def start(
+        self,
+        db: TurriDB,
+        name: str,
+        func: Callable[[], Awaitable[dict | None]],
+        params: dict | None = None,
+    ) -> Job:
+        """
+        Starts `func` in the background and returns its Job right away. The dict
+        `func` returns becomes the job's result.
+
+        Raises:
+            JobAlreadyRunning: If a job of this name is running.
+        """
+        if name in self._tasks:
+            raise JobAlreadyRunning(name)
+
+        now = datetime.now()
+        # jobs of a crashed process never finished, release their slot
+        await db.update_where(
+            Job,
+            [
+                Job.name == name,
+                Job.status == "running",
+                Job.heartbeat_at < now - timedelta(seconds=STALE_AFTER_S),
+            ],
+            {"status": "failed", "finished_at": now},
+        )
+        job = Job(
+            id=str(uuid4()),
+            name=name,
+            status="running",
+            params=params or {},
+            started_at=now,
+            heartbeat_at=now,
+        )
+        try:
+            await db.save(job)
+        except IntegrityError:
+            raise JobAlreadyRunning(name)
+
+        task = asyncio.create_task(self._run(db, job, func))
+        self._tasks[name] = task
+        task.add_done_callback(lambda _: self._tasks.pop(name, None))
+        return job
+
+    async def _run(
+        self, db: TurriDB, job: Job, func: Callable[[], Awaitable[dict | None]]
+    ) -> None:
+        _current_job.set(job)
+        heartbeat = asyncio.create_task(self._heartbeat(db, job))
+        try:
+            with query_scope(f"job {job.name}") as stats:
+                result = await func()
+            job.result = {**(result or {}), "db_stats": stats.summary(top=5)}
+            job.status = "succeeded"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception(f"Job '{job.name}' ({job.id}) failed")
+            job.errors = [*job.errors, f"{type(e).__name__}: {e}"]
+            job.status = "failed"
+        finally:
+            heartbeat.cancel()
+            # a heartbeat save in flight must not overwrite the final state
+            with contextlib.suppress(asyncio.CancelledError):
+                await heartbeat
+            job.finished_at = job.heartbeat_at = datetime.now()
+            await db.save(job)
+            logger.info(
+                f"Job '{job.name}' {job.status}: {job.done}/{job.total or '?'} done, "
+                f"{len(job.errors)} errors"
+            )
+
+    @staticmethod
+    async def _heartbeat(db: TurriDB, job: Job) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_S)
+            job.heartbeat_at = datetime.now()
+            try:
+                await db.save(job)
+            except Exception as e:
+                logger.warning(f"Failed to save progress of job {job.id}: {e}")
+
+    async def stop(self) -> None:
+        """
+        Cancels the running jobs, they end up as "cancelled".
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+job_runner = JobRunner()
@@ -0,0 +1,65 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Field, SQLModel
+
+
+class SyncState(SQLModel, table=True):
+    resource: str = Field(primary_key=True)
+    # GMT timestamp of the newest record synced, the next run fetches newer ones
+    watermark: Optional[datetime] = None
+    last_run: Optional[datetime] = None
+    last_full_sync: Optional[datetime] = None
+    # Progress of the current `fetch_all_wocommerce_data` run, kept until the run
+    # finished so an interrupted run resumes where it stopped
+    run_started_at: Optional[datetime] = None
+    run_full: bool = False
+    run_done: bool = False
+    # next page to fetch of the list sync steps
+    run_checkpoint: Optional[int] = None
+    run_newest_ok: Optional[datetime] = None
+    run_oldest_failed: Optional[datetime] = None
+
+
+class SyncFailure(SQLModel, table=True):
+    """
+    A record a sync failed to save, retried at the start of the next run.
+
+    After `sync_max_failure_attempts` attempts it is dead-lettered: no longer
+    retried and no longer holding back the watermark. The row stays until the
+    record is saved, e.g. by a full sync or a webhook.
+    """
+
+    resource: str = Field(primary_key=True)
+    entity_id: int = Field(primary_key=True)
+    error: str
+    failed_at: datetime
+    attempts: int = 1
+
+
+class Job(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    name: str = Field(index=True)
+    # "running", "succeeded", "failed" or "cancelled"
+    status: str
+    params: Optional[dict] = Field(sa_column=Column(JSONB), default_factory=dict)
+    done: int = 0
+    total: Optional[int] = None
+    errors: list[str] = Field(sa_column=Column(JSONB), default_factory=list)
+    result: Optional[dict] = Field(sa_column=Column(JSONB), default=None)
+    started_at: datetime
+    # bumped while the job runs, a running job without heartbeat has died
+    heartbeat_at: datetime
+    finished_at: Optional[datetime] = None
+
+    __table_args__ = (
+        # at most one running job per name, also across processes
+        Index(
+            "uq_job_running_name",
+            "name",
+            unique=True,
+            postgresql_where=text("status = 'running'"),
+        ),
+    )
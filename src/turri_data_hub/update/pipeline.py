@@ -0,0 +1,177 @@
+import asyncio
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable
+
+from loguru import logger
+
+# Marks the end of a queue, one per worker of the next stage
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline, `func` turns an item into the item for the next stage.
+
+    Runs `concurrency` workers. Returning None drops the item. If `func` raises,
+    the item is dropped as well and handed to `on_error`, e.g. to mark the records
+    of a page as failed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Awaitable[Any]],
+        concurrency: int = 1,
+        on_error: Callable[[Any, Exception], None] | None = None,
+    ):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.on_error = on_error
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    async def _process(self, item: Any) -> Any:
+        self.items_in += 1
+        start = time.perf_counter()
+        try:
+            result = await self.func(item)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Pipeline stage '{self.name}' failed: {e}")
+            if self.on_error is not None:
+                self.on_error(item, e)
+            return None
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+        if result is not None:
+            self.items_out += 1
+        return result
+
+    def summary(self, wall_s: float) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.items_in, 2) if self.items_in else 0,
+            "max_ms": round(self.max_ms, 2),
+            "items_per_s": round(self.items_in / wall_s, 2) if wall_s else 0,
+        }
+
+
+class Pipeline:
+    """
+    Streams items from `source` through the stages, which are connected by queues
+    of at most `queue_size` items. A full queue blocks the stage before it, so a
+    slow stage (e.g. the database) throttles the fetching instead of piling up
+    pages in memory, while all stages work at the same time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        source: AsyncIterable,
+        stages: list[Stage],
+        queue_size: int = 4,
+    ):
+        self.name = name
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source_items = 0
+        self.wall_s = 0.0
+        self._source_error: Exception | None = None
+
+    async def _feed(self, out: asyncio.Queue) -> None:
+        async for item in self.source:
+            self.source_items += 1
+            await out.put(item)
+
+    async def _work(
+        self, stage: Stage, inbox: asyncio.Queue, out: asyncio.Queue | None
+    ) -> None:
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            result = await stage._process(item)
+            if result is not None and out is not None:
+                await out.put(result)
+
+    async def _run_stage(
+        self,
+        stage: Stage,
+        inbox: asyncio.Queue,
+        out: asyncio.Queue | None,
+        out_workers: int,
+    ) -> None:
+        await asyncio.gather(
+            *(self._work(stage, inbox, out) for _ in range(stage.concurrency))
+        )
+        for _ in range(out_workers):
+            await out.put(_DONE)
+
+    async def _run_source(self, out: asyncio.Queue) -> None:
+        try:
+            await self._feed(out)
+        except Exception as e:
+            # let the items already taken from the source finish, then raise
+            logger.error(f"Pipeline '{self.name}' source failed: {e}")
+            self._source_error = e
+        for _ in range(self.stages[0].concurrency):
+            await out.put(_DONE)
+
+    async def run(self) -> dict:
+        """
+        Runs until the source is exhausted and every item went through all stages.
+        If the source raises, the items it already yielded are still processed
+        before the exception is raised.
+        """
+        queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self._run_source(queues[0]))]
+        for i, stage in enumerate(self.stages):
+            last = i + 1 == len(self.stages)
+            tasks.append(
+                asyncio.create_task(
+                    self._run_stage(
+                        stage,
+                        queues[i],
+                        None if last else queues[i + 1],
+                        0 if last else self.stages[i + 1].concurrency,
+                    )
+                )
+            )
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.wall_s = time.perf_counter() - start
+        if self._source_error is not None:
+            raise self._source_error
+
+        summary = self.summary()
+        logger.info(
+            f"Pipeline '{self.name}': {self.source_items} items in "
+            f"{self.wall_s:.1f}s, "
+            + ", ".join(
+                f"{name} {s['items_in']} ({s['avg_ms']}ms avg, {s['errors']} errors)"
+                for name, s in summary["stages"].items()
+            )
+        )
+        return summary
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "source_items": self.source_items,
+            "wall_s": round(self.wall_s, 2),
+            "stages": {stage.name: stage.summary(self.wall_s) for stage in self.stages},
+        }
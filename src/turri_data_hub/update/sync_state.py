@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+from sqlmodel import SQLModel
+
+from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.settings import WoocommerceSettings
+
+
+class Watermark:
+    """
+    Tracks the newest modification date synced for a resource, starting from the
+    watermark of the previous run (`since`, None for a full sync).
+
+    Never advances past a record that failed to save, so the next incremental
+    run fetches it again, unless the record already failed `max_attempts` times
+    (`attempts` counts the earlier failures): such a record is dead-lettered
+    instead of pinning the watermark forever. Also collects which records failed
+    or succeeded, and which pages are done so an interrupted run can resume
+    after `resume_page`.
+    """
+
+    def __init__(
+        self,
+        since: datetime | None = None,
+        start_page: int = 1,
+        attempts: dict[int, int] | None = None,
+        max_attempts: int | None = None,
+    ):
+        self.since = since
+        self.newest_ok: datetime | None = None
+        self.oldest_failed: datetime | None = None
+        self.start_page = start_page
+        self.attempts = attempts if attempts is not None else {}
+        self.max_attempts = max_attempts
+        self.done_pages: set[int] = set()
+        self.failures: dict[int, str] = {}
+        self.succeeded: set[int] = set()
+        # persists the progress, see `checkpoint`
+        self.on_checkpoint: Callable[["Watermark"], Awaitable[None]] | None = None
+
+    def ok(self, modified: datetime | None, entity_id: int | None = None) -> None:
+        if entity_id is not None:
+            self.succeeded.add(int(entity_id))
+            self.failures.pop(int(entity_id), None)
+        if modified is None:
+            return
+        if self.newest_ok is None or modified > self.newest_ok:
+            self.newest_ok = modified
+
+    def failed(
+        self, modified: datetime | None, entity_id: int | None = None, error: str = ""
+    ) -> None:
+        if entity_id is not None:
+            self.failures[int(entity_id)] = error
+            self.succeeded.discard(int(entity_id))
+            if self.is_dead_letter(int(entity_id)):
+                logger.warning(
+                    f"Dead-lettered record {entity_id} after "
+                    f"{self.attempts[int(entity_id)] + 1} failed attempts: {error}"
+                )
+                return
+        # records without a date are only retried by the next full sync
+        if modified is None:
+            return
+        if self.oldest_failed is None or modified < self.oldest_failed:
+            self.oldest_failed = modified
+
+    def is_dead_letter(self, entity_id: int) -> bool:
+        """
+        Whether the record fails for the `max_attempts`th time or more now.
+        """
+        return (
+            self.max_attempts is not None
+            and self.attempts.get(entity_id, 0) + 1 >= self.max_attempts
+        )
+
+    def page_done(self, page: int) -> None:
+        self.done_pages.add(page)
+
+    @property
+    def resume_page(self) -> int:
+        """
+        First page not done yet, pages complete out of order.
+        """
+        page = self.start_page
+        while page in self.done_pages:
+            page += 1
+        return page
+
+    async def checkpoint(self) -> None:
+        if self.on_checkpoint is not None:
+            await self.on_checkpoint(self)
+
+    @property
+    def value(self) -> datetime | None:
+        value = max(filter(None, [self.since, self.newest_ok]), default=None)
+        if self.oldest_failed is not None:
+            value = min(
+                filter(None, [value, self.oldest_failed - timedelta(seconds=1)])
+            )
+        return value
+
+
+def fetch_since(watermark: Watermark) -> datetime | None:
+    """
+    GMT date to list changes from, a bit before the watermark to absorb clock and
+    timezone differences. None lists everything.
+    """
+    if watermark.since is None:
+        return None
+    overlap = timedelta(hours=WoocommerceSettings().sync_overlap_hours)
+    return watermark.since - overlap
+
+
+def modified_after_params(watermark: Watermark) -> dict:
+    # ordered by id so page numbers stay stable while a run resumes
+    params = {"orderby": "id", "order": "asc"}
+    since = fetch_since(watermark)
+    if since is not None:
+        params.update(modified_after=since.isoformat(), dates_are_gmt="true")
+    return params
+
+
+def list_params(watermark: Watermark, include: list[int] | None) -> dict:
+    """
+    Query of a list sync: the given records only, or the changes since the watermark.
+    """
+    if include is not None:
+        return {"include": ",".join(map(str, include))}
+    return modified_after_params(watermark)
+
+
+def parse_gmt(data: dict, key: str) -> datetime | None:
+    return datetime.fromisoformat(data[key]) if data.get(key) else None
+
+
+class SyncPage:
+    """
+    One page of API records on its way through a sync pipeline, each stage fills
+    in the next field.
+    """
+
+    def __init__(self, number: int, records: list[dict]):
+        self.number = number
+        self.records = records
+        self.extra: dict[int, Any] = {}
+        self.texts: list[str] = []
+        self.embeddings: list[list[float]] = []
+        self.models: list[tuple[dict, SQLModel]] = []
+
+
+def fail_page(watermark: Watermark, date_key: str):
+    """
+    `on_error` handler for pipeline stages, a page that failed as a whole holds
+    the watermark back at its oldest record.
+    """
+
+    def on_error(page: SyncPage, e: Exception) -> None:
+        for data in page.records:
+            watermark.failed(parse_gmt(data, date_key), data.get("id"), str(e))
+        # its records are retried from the failure list, not by redoing the page
+        watermark.page_done(page.number)
+
+    return on_error
+
+
+async def upsert_records(
+    db: TurriDB,
+    records: list[tuple[dict, SQLModel]],
+    watermark: Watermark,
+    date_key: str,
+) -> list[SQLModel]:
+    """
+    Upserts the models built from one page of API records in one statement. If
+    that fails, they are saved one by one so a single bad row doesn't hold back
+    the rest of the page.
+
+    Returns:
+        list: The models that were saved.
+    """
+    try:
+        await db.upsert_all([model for _, model in records])
+        for data, _ in records:
+            watermark.ok(parse_gmt(data, date_key), data.get("id"))
+        return [model for _, model in records]
+    except Exception as e:
+        logger.warning(
+            f"Bulk save of {len(records)} records failed "
+            f"({type(e).__name__}), saving one by one"
+        )
+
+    saved = []
+    for data, model in records:
+        try:
+            await db.upsert_all([model])
+            watermark.ok(parse_gmt(data, date_key), data.get("id"))
+            saved.append(model)
+        except Exception as e:
+            watermark.failed(parse_gmt(data, date_key), data.get("id"), str(e))
+            logger.error(
+                f"Error saving {type(model).__name__} {data.get('id', 'unknown')}: {e}"
+            )
+    return saved
@@ -0,0 +1,289 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import tuple_
+
+from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.embedding import compute_embeddings
+from src.turri_data_hub.query_stats import query_scope
+from src.turri_data_hub.recommendation_system.compute_taste_embeddings import (
+    update_producer_tastes,
+)
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    recommendation_index,
+)
+from src.turri_data_hub.update.models import SyncFailure
+from src.turri_data_hub.woocommerce.fetch.customers import create_customer
+from src.turri_data_hub.woocommerce.fetch.orders import create_order, customer_id_of
+from src.turri_data_hub.woocommerce.fetch.products import (
+    ProductRefs,
+    fetch_wp_products,
+    generate_product,
+)
+from src.turri_data_hub.woocommerce.fetch.utils import get_text, woocommerce_client
+from src.turri_data_hub.woocommerce.models import Customer, Order, Producer, Product
+
+
+def verify_signature(body: bytes, signature: str | None, secret: str) -> bool:
+    """
+    WooCommerce signs the raw body: base64 of its HMAC-SHA256 with the webhook secret.
+    """
+    if not signature:
+        return False
+    expected = base64.b64encode(
+        hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    ).decode()
+    return hmac.compare_digest(expected, signature)
+
+
+async def refresh_producer_tastes(db: TurriDB, producer_ids: set[int]) -> None:
+    changed = await update_producer_tastes(db, producer_ids)
+    await recommendation_index.refresh(db, Producer, changed)
+
+
+async def upsert_product(db: TurriDB, data: dict) -> None:
+    """
+    Same mapping as the product sync, plus the taste embedding of its producer,
+    before and after a move.
+    """
+    product_id = int(data["id"])
+    refs = await ProductRefs.load_for(db, [data])
+    wp_products = await fetch_wp_products([product_id])
+    if product_id not in wp_products:
+        raise ValueError(f"product {product_id} not in wp/v2 list")
+    wp_data = wp_products[product_id]
+
+    embeddings = await compute_embeddings(
+        [get_text(wp_data["content"]["rendered"], wp_data["excerpt"]["rendered"])],
+        db=db,
+    )
+    product = generate_product(data, wp_data, refs, embeddings[0])
+
+    previous = await db.get_many(Product, [product_id])
+    await db.upsert_all([product])
+    await recommendation_index.refresh(db, Product, [product_id])
+
+    producer_ids = {product.producer_id}
+    if product_id in previous:
+        producer_ids.add(previous[product_id].producer_id)
+    await refresh_producer_tastes(db, producer_ids - {None})
+
+
+async def trash_product(db: TurriDB, data: dict) -> None:
+    """
+    Line items and links keep referencing the row, so it is only unpublished.
+    It is no longer recommended nor part of its producer's taste.
+    """
+    product_id = int(data["id"])
+    await db.update_where(Product, [Product.id == product_id], {"status": "trash"})
+    await recommendation_index.refresh(db, Product, [product_id])
+
+    products = await db.get_many(Product, [product_id])
+    if product_id in products and products[product_id].producer_id is not None:
+        await refresh_producer_tastes(db, {products[product_id].producer_id})
+
+
+async def upsert_order(db: TurriDB, data: dict) -> None:
+    customer_id = customer_id_of(data)
+    if customer_id is not None and not await db.get_many(Customer, [customer_id]):
+        logger.info(f"Skipping order {data['id']} because we can't find customer")
+        return
+    await db.upsert_all([create_order(data)])
+
+
+async def trash_order(db: TurriDB, data: dict) -> None:
+    await db.update_where(Order, [Order.id == int(data["id"])], {"status": "trash"})
+
+
+async def upsert_customer(db: TurriDB, data: dict) -> None:
+    await db.upsert_all([create_customer(data)])
+
+
+async def delete_customer(db: TurriDB, data: dict) -> None:
+    customer_id = int(data.get("id") or 0) or None
+    if customer_id is None:
+        logger.info("Skipping customer deletion without a customer id")
+        return
+    # their orders stay, as guest orders
+    await db.update_where(
+        Order, [Order.customer_id == customer_id], {"customer_id": None}
+    )
+    await db.delete_where(Customer, [Customer.id == customer_id])
+
+
+# (resource, event) of the X-WC-Webhook-Topic header to its handler
+WEBHOOK_HANDLERS = {
+    ("product", "created"): upsert_product,
+    ("product", "updated"): upsert_product,
+    ("product", "restored"): upsert_product,
+    ("product", "deleted"): trash_product,
+    ("order", "created"): upsert_order,
+    ("order", "updated"): upsert_order,
+    ("order", "restored"): upsert_order,
+    ("order", "deleted"): trash_order,
+    ("customer", "created"): upsert_customer,
+    ("customer", "updated"): upsert_customer,
+    ("customer", "deleted"): delete_customer,
+}
+
+
+def parse_topic(topic: str) -> tuple[str, str] | None:
+    resource, _, event = topic.partition(".")
+    key = (resource, event)
+    return key if key in WEBHOOK_HANDLERS else None
+
+
+# SyncFailure resource of the sync step that re-fetches a webhook's entity
+WEBHOOK_SYNC_RESOURCES = {
+    "product": "products",
+    "order": "orders",
+    "customer": "customers",
+}
+
+
+class WebhookQueue:
+    """
+    Applies webhook deliveries one at a time in the background, so the shop
+    gets its response right away and updates of one entity stay in order.
+
+    The shop doesn't resend deliveries it got a 200 for, so `stop` applies the
+    backlog before shutting down, see there.
+    """
+
+    def __init__(self, maxsize: int | None = None):
+        self.maxsize = maxsize
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._db: TurriDB | None = None
+        self._current: tuple[tuple[str, str], dict] | None = None
+        self.received = 0
+        self.applied = 0
+        self.failed = 0
+
+    def start(self, db: TurriDB) -> None:
+        maxsize = self.maxsize
+        if maxsize is None:
+            maxsize = woocommerce_client.settings.webhook_queue_size
+        self._db = db
+        self._queue = asyncio.Queue(maxsize)
+        self._worker = asyncio.create_task(self._work(db))
+
+    async def stop(self, timeout_s: float | None = None) -> None:
+        """
+        Stops taking deliveries and waits up to `timeout_s` for the queued ones
+        to be applied. Whatever is left is recorded as SyncFailure, so the next
+        sync fetches those records again.
+        """
+        if self._worker is None:
+            return
+        # new deliveries get a 503 from now on, the shop retries them
+        worker, self._worker = self._worker, None
+        if timeout_s is None:
+            timeout_s = woocommerce_client.settings.webhook_drain_timeout_s
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout_s)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Webhook backlog not applied within {timeout_s}s, "
+                "recording it for the next sync"
+            )
+        # the delivery being applied when the timeout hit counts as pending too
+        pending = [self._current] if self._current is not None else []
+        worker.cancel()
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            await self._record_failures(
+                [
+                    (topic, data, "not applied before shutdown")
+                    for topic, data in pending
+                ]
+            )
+
+    async def _record_failures(
+        self, failed: list[tuple[tuple[str, str], dict, str]]
+    ) -> None:
+        """
+        Records deliveries that were not applied, with why, as SyncFailure so the
+        next sync fetches those records again. A record that failed before gets
+        one more attempt counted, like the failures of the sync itself.
+        """
+        now = datetime.now()
+        errors = {
+            (WEBHOOK_SYNC_RESOURCES[resource], int(data["id"])): (
+                f"{resource}.{event} webhook {reason}"
+            )
+            for (resource, event), data, reason in failed
+            if data.get("id")
+        }
+        if not errors:
+            return
+        try:
+            existing = await self._db.query_table(
+                SyncFailure,
+                where_clauses=[
+                    tuple_(SyncFailure.resource, SyncFailure.entity_id).in_(
+                        list(errors)
+                    )
+                ],
+            )
+            attempts = {(f.resource, f.entity_id): f.attempts for f in existing}
+            await self._db.upsert_all(
+                [
+                    SyncFailure(
+                        resource=resource,
+                        entity_id=entity_id,
+                        error=error,
+                        failed_at=now,
+                        attempts=attempts.get((resource, entity_id), 0) + 1,
+                    )
+                    for (resource, entity_id), error in errors.items()
+                ]
+            )
+            logger.info(f"Recorded {len(errors)} unapplied webhooks for the next sync")
+        except Exception:
+            logger.exception(f"Lost {len(errors)} unapplied webhooks")
+
+    def enqueue(self, topic: tuple[str, str], data: dict) -> None:
+        """
+        Raises:
+            RuntimeError: If the worker isn't running.
+            asyncio.QueueFull: If the backlog is full, the shop retries later.
+        """
+        if self._worker is None:
+            raise RuntimeError("Webhook worker is not running")
+        self._queue.put_nowait((topic, data))
+        self.received += 1
+
+    async def _work(self, db: TurriDB) -> None:
+        while True:
+            self._current = await self._queue.get()
+            (resource, event), data = self._current
+            try:
+                with query_scope(f"webhook {resource}.{event}"):
+                    await WEBHOOK_HANDLERS[(resource, event)](db, data)
+                self.applied += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(
+                    f"Failed to apply {resource}.{event} webhook for {data.get('id')}"
+                )
+                await self._record_failures([((resource, event), data, f"failed: {e}")])
+            finally:
+                self._current = None
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "applied": self.applied,
+            "failed": self.failed,
+            "backlog": self._queue.qsize() if self._queue else 0,
+        }
+
+
+webhook_queue = WebhookQueue()
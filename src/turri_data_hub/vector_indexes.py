@@ -0,0 +1,27 @@
+from sqlalchemy import Index, MetaData
+
+VECTOR_INDEX_METHODS = ("hnsw", "ivfflat")
+
+
+def hnsw_index(table_name: str, column: str) -> Index:
+    """
+    HNSW index for nearest neighbour search with `l2_distance` on a pgvector column.
+    """
+    return Index(
+        f"ix_{table_name}_{column}_hnsw",
+        column,
+        postgresql_using="hnsw",
+        postgresql_ops={column: "vector_l2_ops"},
+    )
+
+
+def get_vector_indexes(metadata: MetaData) -> list[Index]:
+    """
+    All approximate nearest neighbour indexes declared on the tables of `metadata`.
+    """
+    return [
+        index
+        for table in metadata.sorted_tables
+        for index in table.indexes
+        if index.dialect_options["postgresql"]["using"] in VECTOR_INDEX_METHODS
+    ]
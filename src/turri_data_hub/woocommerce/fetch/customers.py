@@ -1,21 +1,97 @@
 from datetime import datetime
+from typing import AsyncIterator
 
 from loguru import logger
 
 from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.update.sync_state import (
+    Watermark,
+    fetch_since,
+    list_params,
+    parse_gmt,
+    upsert_records,
+)
 from src.turri_data_hub.woocommerce.models import (
     Customer,
 )
 
-from .utils import fetch_list
+from .utils import (
+    fetch_numbered_pages,
+    woocommerce_client,
+)
+
+CUSTOMERS_URL = "wp-json/wc/v3/customers"
+
+
+def create_customer(data: dict) -> Customer:
+    data["date_created"] = datetime.fromisoformat(data["date_created"])
+    return Customer(**data)
+
 
+async def fetch_customers_created_after(
+    since: datetime, per_page: int = 50, start_page: int = 1
+) -> AsyncIterator[tuple[int, list]]:
+    """
+    The customers endpoint can't filter by date, so pages are read newest first
+    until the first customer created before `since` (GMT).
+    """
+    page = start_page
+    while True:
+        customers = await woocommerce_client.get_json(
+            CUSTOMERS_URL,
+            params={
+                "per_page": per_page,
+                "page": page,
+                "orderby": "registered_date",
+                "order": "desc",
+            },
+        )
+        new = [c for c in customers if parse_gmt(c, "date_created_gmt") > since]
+        if new:
+            yield page, new
+        if len(new) < len(customers) or len(customers) < per_page:
+            return
+        page += 1
 
-async def fetch_create_and_save_customers(db: TurriDB, per_page: int = 50):
-    customers = fetch_list("wp-json/wc/v3/customers", per_page=per_page)
 
-    for data in customers:
-        try:
-            data["date_created"] = datetime.fromisoformat(data["date_created"])
-            await db.save(Customer(**data))
-        except Exception as e:
-            logger.error(f"Failed to save customer: {e} | Data: {data}")
+async def fetch_create_and_save_customers(
+    db: TurriDB,
+    per_page: int = 50,
+    watermark: Watermark | None = None,
+    include: list[int] | None = None,
+) -> Watermark:
+    """
+    Syncs the customers created since the watermark, all customers without one,
+    or only the customers in `include`.
+    """
+    watermark = watermark or Watermark()
+    since = fetch_since(watermark)
+    if include is not None:
+        pages = fetch_numbered_pages(
+            CUSTOMERS_URL, per_page=per_page, params=list_params(watermark, include)
+        )
+    elif since is not None:
+        pages = fetch_customers_created_after(
+            since, per_page=per_page, start_page=watermark.start_page
+        )
+    else:
+        pages = fetch_numbered_pages(
+            CUSTOMERS_URL,
+            per_page=per_page,
+            params=list_params(watermark, include),
+            start_page=watermark.start_page,
+        )
+    async for number, customers in pages:
+        records = []
+        for data in customers:
+            try:
+                records.append((data, create_customer(data)))
+            except Exception as e:
+                watermark.failed(
+                    parse_gmt(data, "date_created_gmt"), data.get("id"), str(e)
+                )
+                logger.error(f"Failed to save customer: {e} | Data: {data}")
+        await upsert_records(db, records, watermark, "date_created_gmt")
+        watermark.page_done(number)
+        await watermark.checkpoint()
+    return watermark
@@ -1,29 +1,37 @@
 from datetime import datetime
 
 from loguru import logger
-from tqdm import tqdm
 
 from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.update.pipeline import Pipeline, Stage
+from src.turri_data_hub.update.sync_state import (
+    SyncPage,
+    Watermark,
+    fail_page,
+    list_params,
+    parse_gmt,
+    upsert_records,
+)
 from src.turri_data_hub.woocommerce.models import (
     Customer,
     LineItem,
     Order,
 )
 
-from .utils import fetch_list
+from .utils import (
+    fetch_numbered_pages,
+    woocommerce_client,
+)
 
 
-async def fetch_create_and_save_order(
-    data: dict,
-    db: TurriDB,
-):
-    customer = await db.query_table(
-        Customer, [Customer.id == data["customer_id"]], mode="first"
-    )
+def customer_id_of(data: dict) -> int | None:
+    """
+    The customer of an order, None for guest orders (customer_id 0).
+    """
+    return int(data["customer_id"]) or None
 
-    if customer is None:
-        logger.info(f"Skipping order {data['id']} because we can't find customer")
 
+def create_order(data: dict) -> Order:
     line_items = [
         LineItem(
             id=int(item["id"]),
@@ -35,26 +43,105 @@ async def fetch_create_and_save_order(
         for item in data["line_items"]
     ]
 
-    order = Order(
+    return Order(
         id=data["id"],
         date_created=datetime.fromisoformat(data["date_created"]),
         status=data["status"],
-        customer_id=data["customer_id"],
+        customer_id=customer_id_of(data),
         currency=data["currency"],
         total=float(data["total"]),
         total_tax=float(data["total_tax"]),
         prices_include_tax=data["prices_include_tax"],
         line_items=line_items,
-        customer=customer,
     )
-    await db.save(order)
 
 
-async def fetch_create_and_save_orders(db: TurriDB, per_page: int = 50):
-    orders = fetch_list("wp-json/wc/v3/orders", per_page=per_page)
+def order_pipeline(
+    db: TurriDB,
+    per_page: int,
+    watermark: Watermark,
+    customer_ids: set[int],
+    include: list[int] | None = None,
+) -> Pipeline:
+    """
+    Order pages flow through: build -> upsert, the orders and line items of a
+    page are written in one transaction.
+
+    `customer_ids` are the customers known at the start, only customers missing
+    from it are looked up, e.g. those created by a webhook since.
+    """
+    settings = woocommerce_client.settings
+    on_error = fail_page(watermark, "date_modified_gmt")
+
+    # looked up once per pipeline
+    unknown_ids: set[int] = set()
 
-    for data in tqdm(orders):
-        try:
-            await fetch_create_and_save_order(data, db)
-        except Exception as e:
-            logger.error(f"Failed to save order: {e} | Data: {data.get('id')}")
+    async def build(page: SyncPage) -> SyncPage:
+        missing = (
+            {customer_id_of(data) for data in page.records}
+            - {None}
+            - customer_ids
+            - unknown_ids
+        )
+        if missing:
+            found = await db.query_ids(Customer, [Customer.id.in_(missing)])
+            customer_ids.update(found)
+            unknown_ids.update(missing - found)
+        for data in page.records:
+            customer_id = customer_id_of(data)
+            if customer_id is not None and customer_id not in customer_ids:
+                # retried on the next sync, the customer may not be synced yet
+                watermark.failed(
+                    parse_gmt(data, "date_modified_gmt"), data["id"], "unknown customer"
+                )
+                logger.info(
+                    f"Skipping order {data['id']} because we can't find customer"
+                )
+                continue
+            try:
+                page.models.append((data, create_order(data)))
+            except Exception as e:
+                watermark.failed(
+                    parse_gmt(data, "date_modified_gmt"), data.get("id"), str(e)
+                )
+                logger.error(f"Failed to save order: {e} | Data: {data.get('id')}")
+        return page
+
+    async def save(page: SyncPage) -> None:
+        await upsert_records(db, page.models, watermark, "date_modified_gmt")
+        watermark.page_done(page.number)
+        await watermark.checkpoint()
+
+    return Pipeline(
+        "orders",
+        (
+            SyncPage(number, page)
+            async for number, page in fetch_numbered_pages(
+                "wp-json/wc/v3/orders",
+                per_page=per_page,
+                params=list_params(watermark, include),
+                start_page=watermark.start_page,
+            )
+        ),
+        [
+            Stage("build", build, settings.upsert_concurrency, on_error),
+            Stage("upsert", save, settings.upsert_concurrency, on_error),
+        ],
+        queue_size=settings.pipeline_queue_size,
+    )
+
+
+async def fetch_create_and_save_orders(
+    db: TurriDB,
+    per_page: int = 50,
+    watermark: Watermark | None = None,
+    include: list[int] | None = None,
+) -> Watermark:
+    """
+    Syncs the orders modified since the watermark, all orders without one, or
+    only the orders in `include`.
+    """
+    watermark = watermark or Watermark()
+    customer_ids = await db.query_ids(Customer)
+    await order_pipeline(db, per_page, watermark, customer_ids, include).run()
+    return watermark
@@ -1,34 +1,54 @@
+import asyncio
+
 from loguru import logger
-from tqdm import tqdm
 
 from src.turri_data_hub.db import TurriDB
 from src.turri_data_hub.embedding import compute_embeddings
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    recommendation_index,
+)
+from src.turri_data_hub.settings import database_settings
+from src.turri_data_hub.update.pipeline import Pipeline, Stage
+from src.turri_data_hub.update.sync_state import (
+    SyncPage,
+    Watermark,
+    fail_page,
+    fetch_since,
+    parse_gmt,
+    upsert_records,
+)
 from src.turri_data_hub.woocommerce.models import (
     Producer,
 )
 
-from ...recommendation_system.taste_categories import TASTE_KEYS
-from .utils import fetch_list, fetch_single, get_text
+from .utils import (
+    fetch_numbered_pages,
+    fetch_single,
+    get_text,
+    woocommerce_client,
+)
 
 
-async def generate_producer(data: dict, db: TurriDB) -> None:
-    img = None
+async def fetch_producer_image(data: dict) -> str | None:
     try:
-        img = fetch_single(
+        return await fetch_single(
             data["_links"]["wp:attachment"][0]["href"],
             lambda x: x[0]["media_details"]["sizes"]["thumbnail"]["source_url"],
         )
     except Exception:
         logger.debug("Could not fetch image")
-        pass
+        return None
+
+
+def generate_producer(data: dict, img: str | None, embedding: list[float]) -> Producer:
+    """
+    The taste embedding is left unset: it is the average of the producer's
+    products, computed by the taste step, and an upsert keeps the stored one.
+    """
     if data["status"] != "publish":
         logger.info(f"unkown status '{data['status']}'")
 
-    embeddings = await compute_embeddings(
-        [get_text(data["content"]["rendered"], data["excerpt"]["rendered"])]
-    )
-
-    producer = Producer(
+    return Producer(
         id=data["id"],
         link=data["link"],
         title=data["title"]["rendered"],
@@ -36,22 +56,101 @@ async def generate_producer(data: dict, db: TurriDB) -> None:
         excerpt=data["excerpt"]["rendered"],
         slug=data["slug"],
         img_url=img,
-        embedding=embeddings[0],
-        taste_embedding=[0] * len(TASTE_KEYS),
+        embedding=embedding,
     )
-    await db.save(producer)
 
 
-async def fetch_generate_and_save_producers(db: TurriDB, per_page=50):
-    producers = fetch_list(
-        url="/wp-json/wp/v2/productor",
-        per_page=per_page,
-    )
+def producer_pipeline(
+    db: TurriDB, per_page: int, watermark: Watermark, include: list[int] | None = None
+) -> Pipeline:
+    """
+    Producer pages flow through: images -> text -> embeddings -> upsert, the
+    attachment requests of a page run concurrently.
+    """
+    settings = woocommerce_client.settings
+    on_error = fail_page(watermark, "modified_gmt")
+    since = fetch_since(watermark)
+    params = {"orderby": "id", "order": "asc"}
+    if include is not None:
+        params = {"include": ",".join(map(str, include))}
+    elif since is not None:
+        # the WordPress API has no dates_are_gmt, the overlap covers the offset
+        params["modified_after"] = since.isoformat()
 
-    for producer in tqdm(producers):
-        try:
-            await generate_producer(producer, db)
-        except Exception as e:
-            logger.error(
-                f"Error processing producer {producer.get('id', 'unknown')}: {e}"
+    async def add_images(page: SyncPage) -> SyncPage:
+        images = await asyncio.gather(
+            *(fetch_producer_image(data) for data in page.records)
+        )
+        page.extra = {int(data["id"]): img for data, img in zip(page.records, images)}
+        return page
+
+    async def transform(page: SyncPage) -> SyncPage:
+        page.texts = await asyncio.to_thread(
+            lambda: [
+                get_text(data["content"]["rendered"], data["excerpt"]["rendered"])
+                for data in page.records
+            ]
+        )
+        return page
+
+    async def embed(page: SyncPage) -> SyncPage:
+        page.embeddings = await compute_embeddings(page.texts, db=db)
+        return page
+
+    async def save(page: SyncPage) -> None:
+        for data, embedding in zip(page.records, page.embeddings):
+            try:
+                page.models.append(
+                    (
+                        data,
+                        generate_producer(data, page.extra[int(data["id"])], embedding),
+                    )
+                )
+            except Exception as e:
+                watermark.failed(
+                    parse_gmt(data, "modified_gmt"), data.get("id"), str(e)
+                )
+                logger.error(
+                    f"Error processing producer {data.get('id', 'unknown')}: {e}"
+                )
+        saved = await upsert_records(db, page.models, watermark, "modified_gmt")
+        await recommendation_index.refresh(db, Producer, [m.id for m in saved])
+        watermark.page_done(page.number)
+        await watermark.checkpoint()
+
+    return Pipeline(
+        "producers",
+        (
+            SyncPage(number, page)
+            async for number, page in fetch_numbered_pages(
+                url="/wp-json/wp/v2/productor",
+                per_page=per_page,
+                params=params,
+                start_page=watermark.start_page,
             )
+        ),
+        [
+            Stage("images", add_images, settings.page_concurrency, on_error),
+            Stage("transform", transform, settings.transform_concurrency, on_error),
+            Stage(
+                "embed", embed, database_settings.embedding_max_concurrency, on_error
+            ),
+            Stage("upsert", save, settings.upsert_concurrency, on_error),
+        ],
+        queue_size=settings.pipeline_queue_size,
+    )
+
+
+async def fetch_generate_and_save_producers(
+    db: TurriDB,
+    per_page=50,
+    watermark: Watermark | None = None,
+    include: list[int] | None = None,
+) -> Watermark:
+    """
+    Syncs the producers modified since the watermark, all producers without one,
+    or only the producers in `include`.
+    """
+    watermark = watermark or Watermark()
+    await producer_pipeline(db, per_page, watermark, include).run()
+    return watermark
@@ -1,13 +1,26 @@
 import asyncio
 from datetime import datetime
 
-import requests
 from loguru import logger
-from tqdm import tqdm
 
 from src.turri_data_hub.db import TurriDB
 from src.turri_data_hub.embedding import compute_embeddings
-from src.turri_data_hub.recommendation_system.taste_categories import TASTE_KEYS
+from src.turri_data_hub.recommendation_system.compute_taste_embeddings import (
+    get_product_taste_embeddings,
+)
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    recommendation_index,
+)
+from src.turri_data_hub.settings import database_settings
+from src.turri_data_hub.update.pipeline import Pipeline, Stage
+from src.turri_data_hub.update.sync_state import (
+    SyncPage,
+    Watermark,
+    fail_page,
+    list_params,
+    parse_gmt,
+    upsert_records,
+)
 from src.turri_data_hub.woocommerce.models import (
     Producer,
     Product,
@@ -15,21 +28,84 @@ from src.turri_data_hub.woocommerce.models import (
     ProductTag,
 )
 
-from .utils import fetch_list, get_text
+from .utils import (
+    fetch_numbered_pages,
+    get_text,
+    woocommerce_client,
+)
 
+WP_FIELDS = "id,content,excerpt"
+WP_MAX_PER_PAGE = 100
 
-async def generate_product(
-    data: dict,
-    db: TurriDB,
-) -> Product:
-    category_ids = [cat["id"] for cat in data["categories"]]
-    categories = await db.query_table(
-        ProductCategory, where_clauses=[ProductCategory.id.in_(category_ids)]
-    )
 
-    tag_ids = [cat["id"] for cat in data["tags"]]
-    tags = await db.query_table(ProductTag, where_clauses=[ProductTag.id.in_(tag_ids)])
+class ProductRefs:
+    """
+    Categories, tags and producers by id, loaded once per sync instead of three
+    queries per product.
+    """
+
+    def __init__(self, categories: dict, tags: dict, producers: dict):
+        self.categories: dict[int, ProductCategory] = categories
+        self.tags: dict[int, ProductTag] = tags
+        self.producers: dict[int, Producer] = producers
+
+    @classmethod
+    async def load(cls, db: TurriDB) -> "ProductRefs":
+        return cls(
+            categories={c.id: c for c in await db.query_table(ProductCategory)},
+            tags={t.id: t for t in await db.query_table(ProductTag)},
+            producers={p.id: p for p in await db.query_table(Producer)},
+        )
+
+    @classmethod
+    async def load_for(cls, db: TurriDB, records: list[dict]) -> "ProductRefs":
+        """
+        Only the references of the given products, e.g. for a single webhook.
+        """
+        return cls(
+            categories=await db.get_many(
+                ProductCategory,
+                [c["id"] for data in records for c in data["categories"]],
+            ),
+            tags=await db.get_many(
+                ProductTag, [t["id"] for data in records for t in data["tags"]]
+            ),
+            producers=await db.get_many(
+                Producer,
+                [
+                    int(producer_id)
+                    for data in records
+                    for producer_id in data["meta_box"][
+                        "producto-productor-relationship_from"
+                    ][:1]
+                ],
+            ),
+        )
+
+
+async def fetch_wp_products(ids: list[int]) -> dict[int, dict]:
+    """
+    Content and excerpt of the given products from the WordPress API, which the
+    WooCommerce API doesn't return, in as few requests as possible.
+    """
+    wp_products = {}
+    for i in range(0, len(ids), WP_MAX_PER_PAGE):
+        chunk = ids[i : i + WP_MAX_PER_PAGE]
+        for item in await woocommerce_client.get_json(
+            "/wp-json/wp/v2/product",
+            params={
+                "include": ",".join(map(str, chunk)),
+                "per_page": len(chunk),
+                "_fields": WP_FIELDS,
+            },
+        ):
+            wp_products[int(item["id"])] = item
+    return wp_products
 
+
+def generate_product(
+    data: dict, wp_data: dict, refs: ProductRefs, embedding: list[float]
+) -> Product:
     meta_box = data["meta_box"]
     producer_id = (
         int(meta_box["producto-productor-relationship_from"][0])
@@ -37,23 +113,12 @@ async def generate_product(
         else None
     )
 
-    producer = (
-        await db.query_table(
-            Producer, where_clauses=[Producer.id == producer_id], mode="first"
-        )
-        if producer_id
-        else None
-    )
+    if producer_id is not None and producer_id not in refs.producers:
+        raise ValueError(f"unknown producer {producer_id}")
 
     img = data.get("images")
     img = img[0]["src"] if isinstance(img, list) and img and "src" in img[0] else None
 
-    resp = await asyncio.to_thread(
-        requests.get, f"https://turri.cr/wp-json/wp/v2/product/{data['id']}"
-    )
-    resp.raise_for_status()
-    product_json = resp.json()
-
     date_created = datetime.fromisoformat(data["date_created"])
     date_modified = datetime.fromisoformat(data["date_modified"])
 
@@ -71,24 +136,20 @@ async def generate_product(
     ]
     stripped = {i: a for i, a in data.items() if i not in discard}
 
-    embeddings = await compute_embeddings(
-        [
-            get_text(
-                product_json["content"]["rendered"], product_json["excerpt"]["rendered"]
-            )
-        ]
-    )
-
     product = Product(
         id=int(data["id"]),
         link=data["permalink"],
         title=data["name"],
-        content=product_json["content"]["rendered"],
-        excerpt=product_json["excerpt"]["rendered"],
+        content=wp_data["content"]["rendered"],
+        excerpt=wp_data["excerpt"]["rendered"],
         img_url=img,
-        categories=categories,
-        tags=tags,
-        producer=producer,
+        categories=[
+            refs.categories[c["id"]]
+            for c in data["categories"]
+            if c["id"] in refs.categories
+        ],
+        tags=[refs.tags[t["id"]] for t in data["tags"] if t["id"] in refs.tags],
+        producer=refs.producers.get(producer_id),
         producer_id=producer_id,
         date_created=date_created,
         date_modified=date_modified,
@@ -97,23 +158,129 @@ async def generate_product(
             int(data["stock_quantity"]) if data.get("stock_quantity") else None
         ),
         total_sales=int(data["total_sales"]),
-        embedding=embeddings[0],
-        taste_embedding=[0] * len(TASTE_KEYS),
+        embedding=embedding,
         **stripped,
     )
-    await db.save(product)
+    product.taste_embedding = get_product_taste_embeddings(product)
+    return product
 
 
-async def fetch_generate_and_save_products(db: TurriDB, per_page=50):
-    products = fetch_list(
-        url="/wp-json/wc/v3/products",
-        per_page=per_page,
-    )
+def product_pipeline(
+    db: TurriDB,
+    per_page: int,
+    refs: ProductRefs,
+    watermark: Watermark,
+    include: list[int] | None = None,
+) -> Pipeline:
+    """
+    Product pages flow through: WordPress content -> text -> embeddings -> upsert,
+    one WordPress request, one embedding call and one upsert per page.
+    """
+    settings = woocommerce_client.settings
+    on_error = fail_page(watermark, "date_modified_gmt")
+
+    async def add_wp_content(page: SyncPage) -> SyncPage:
+        page.extra = await fetch_wp_products([int(data["id"]) for data in page.records])
+        found = []
+        for data in page.records:
+            if int(data["id"]) in page.extra:
+                found.append(data)
+            else:
+                watermark.failed(
+                    parse_gmt(data, "date_modified_gmt"),
+                    data["id"],
+                    "not in wp/v2 list",
+                )
+                logger.error(
+                    f"Error processing product {data['id']}: not in wp/v2 list"
+                )
+        page.records = found
+        return page
 
-    for product in tqdm(products):
-        try:
-            await generate_product(product, db)
-        except Exception as e:
-            logger.error(
-                f"Error processing product {product.get('id', 'unknown')}: {e}"
+    def texts(page: SyncPage) -> list[str]:
+        return [
+            get_text(
+                page.extra[int(data["id"])]["content"]["rendered"],
+                page.extra[int(data["id"])]["excerpt"]["rendered"],
             )
+            for data in page.records
+        ]
+
+    async def transform(page: SyncPage) -> SyncPage:
+        page.texts = await asyncio.to_thread(texts, page)
+        return page
+
+    async def embed(page: SyncPage) -> SyncPage:
+        page.embeddings = await compute_embeddings(page.texts, db=db)
+        return page
+
+    async def save(page: SyncPage) -> None:
+        for data, embedding in zip(page.records, page.embeddings):
+            try:
+                page.models.append(
+                    (
+                        data,
+                        generate_product(
+                            data, page.extra[int(data["id"])], refs, embedding
+                        ),
+                    )
+                )
+            except Exception as e:
+                watermark.failed(
+                    parse_gmt(data, "date_modified_gmt"), data.get("id"), str(e)
+                )
+                logger.error(
+                    f"Error processing product {data.get('id', 'unknown')}: {e}"
+                )
+        saved = await upsert_records(db, page.models, watermark, "date_modified_gmt")
+        await recommendation_index.refresh(db, Product, [m.id for m in saved])
+        watermark.page_done(page.number)
+        await watermark.checkpoint()
+
+    return Pipeline(
+        "products",
+        (
+            SyncPage(number, page)
+            async for number, page in fetch_numbered_pages(
+                url="/wp-json/wc/v3/products",
+                per_page=per_page,
+                params=list_params(watermark, include),
+                start_page=watermark.start_page,
+            )
+        ),
+        [
+            Stage(
+                "wp_content",
+                add_wp_content,
+                settings.page_concurrency,
+                on_error,
+            ),
+            Stage(
+                "transform",
+                transform,
+                settings.transform_concurrency,
+                on_error,
+            ),
+            Stage(
+                "embed", embed, database_settings.embedding_max_concurrency, on_error
+            ),
+            Stage("upsert", save, settings.upsert_concurrency, on_error),
+        ],
+        queue_size=settings.pipeline_queue_size,
+    )
+
+
+async def fetch_generate_and_save_products(
+    db: TurriDB,
+    per_page=50,
+    watermark: Watermark | None = None,
+    include: list[int] | None = None,
+) -> Watermark:
+    """
+    Syncs the products modified since the watermark, all products without one,
+    or only the products in `include`.
+    """
+    watermark = watermark or Watermark()
+    refs = await ProductRefs.load(db)
+    await product_pipeline(db, per_page, refs, watermark, include).run()
+    return watermark
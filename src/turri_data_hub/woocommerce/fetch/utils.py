@@ -1,16 +1,299 @@
-from urllib.parse import urljoin
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator
 
-import requests
+import httpx
 from bs4 import BeautifulSoup
-from tqdm import tqdm
+from loguru import logger
 
 from src.turri_data_hub.settings import WoocommerceSettings
 
+# Responses worth retrying besides 429, the host is overloaded or restarting
+RETRY_STATUSES = {500, 502, 503, 504}
 
-def fetch_single(url: str, creator):
-    resp = requests.get(url)
-    resp.raise_for_status()
-    return creator(resp.json())
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, given in seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Limits the requests in flight to the shop with AIMD: every fast response
+    raises the limit by 1/limit (about +1 per round trip), a throttled or failed
+    request halves it and a response slower than `target_latency_s` lowers it by
+    10%. Decreases happen at most once per `target_latency_s`, so a burst of
+    errors from the same round trip counts once.
+
+    A Retry-After pauses all requests, not only the throttled one.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        target_latency_s: float,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        self.throttled = 0
+        self.server_errors = 0
+        self.slow = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+        try:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency_s: float) -> None:
+        if latency_s > self.target_latency_s:
+            self.slow += 1
+            self._decrease(0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttled(self, retry_after: float | None) -> None:
+        self.throttled += 1
+        self._decrease(0.5)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def on_error(self) -> None:
+        self.server_errors += 1
+        self._decrease(0.5)
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.target_latency_s:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "throttled": self.throttled,
+            "server_errors": self.server_errors,
+            "slow_responses": self.slow,
+            "paused_for_s": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+        }
+
+
+class WooCommerceClient:
+    """
+    Pooled keep-alive HTTP client for the WooCommerce and WordPress REST APIs.
+
+    One httpx.AsyncClient is created lazily per event loop and reused by all
+    fetches, relative urls resolve against `WoocommerceSettings.url`. Requests
+    go through an AdaptiveLimiter, GETs are retried on throttling, server errors
+    and connection problems.
+
+    `use_transport` routes all requests through another httpx transport, e.g. to
+    record them or to replay recorded fixtures, see `woocommerce.replay`.
+    """
+
+    def __init__(self):
+        self.transport: httpx.AsyncBaseTransport | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._settings: WoocommerceSettings | None = None
+        self._limiter: AdaptiveLimiter | None = None
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def settings(self) -> WoocommerceSettings:
+        if self._settings is None:
+            self._settings = WoocommerceSettings()
+        return self._settings
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is not None and loop is not self._loop:
+            # the connections belong to the previous loop and can't be reused
+            try:
+                await self.aclose()
+            except Exception as e:
+                logger.debug(f"Could not close the client of a previous loop: {e}")
+        if self._client is None:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.settings.url,
+                auth=(
+                    self.settings.WOOCOMERCE_CLIENT_KEY,
+                    self.settings.WOOCOMERCE_SECRET_KEY,
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.settings.http_max_connections,
+                    max_keepalive_connections=self.settings.http_max_connections,
+                ),
+                timeout=self.settings.http_timeout_s,
+                follow_redirects=True,
+                transport=self.transport,
+            )
+            self._limiter = AdaptiveLimiter(
+                initial=self.settings.http_initial_concurrency,
+                min_limit=1,
+                max_limit=self.settings.http_max_connections,
+                target_latency_s=self.settings.http_target_latency_s,
+            )
+        return self._client
+
+    async def use_transport(self, transport: httpx.AsyncBaseTransport | None) -> None:
+        """
+        Sends the following requests through `transport`, None restores the network.
+        The client of the previous transport is closed.
+        """
+        await self.aclose()
+        self.transport = transport
+
+    async def get(self, url: str, params: dict | None = None) -> httpx.Response:
+        client = await self._get_client()
+        settings = self.settings
+        for attempt in range(settings.http_max_retries + 1):
+            retry_after = None
+            async with self._limiter.slot():
+                self.requests += 1
+                start = time.monotonic()
+                try:
+                    resp = await client.get(url, params=params)
+                except httpx.TransportError as e:
+                    self._limiter.on_error()
+                    error: Exception = e
+                else:
+                    if resp.status_code == 429:
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        self._limiter.on_throttled(retry_after)
+                    elif resp.status_code in RETRY_STATUSES:
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        self._limiter.on_error()
+                    else:
+                        self._limiter.on_success(time.monotonic() - start)
+                        resp.raise_for_status()
+                        return resp
+                    error = httpx.HTTPStatusError(
+                        f"{resp.status_code} for url '{resp.url}'",
+                        request=resp.request,
+                        response=resp,
+                    )
+
+            if attempt == settings.http_max_retries:
+                break
+            # full jitter, unless the host said how long to wait
+            delay = min(
+                settings.http_backoff_max_s,
+                retry_after
+                if retry_after is not None
+                else random.uniform(0, settings.http_backoff_base_s * 2**attempt),
+            )
+            self.retries += 1
+            logger.warning(
+                f"GET {url} failed ({error}), retry {attempt + 1} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+        self.failures += 1
+        raise error
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            **(self._limiter.stats() if self._limiter else {}),
+        }
+
+    async def get_json(self, url: str, params: dict | None = None) -> Any:
+        return (await self.get(url, params=params)).json()
+
+    async def iter_pages(
+        self,
+        url: str,
+        per_page: int = 50,
+        params: dict | None = None,
+        max_concurrency: int | None = None,
+        start_page: int = 1,
+    ) -> AsyncIterator[tuple[int, list]]:
+        """
+        Yields the page numbers and pages of a paginated list endpoint as they arrive.
+
+        `start_page` is fetched first to learn `X-WP-TotalPages`, the remaining pages
+        are then fetched concurrently, at most `max_concurrency` at a time, and
+        yielded in the order they complete.
+        """
+        params = {**(params or {}), "per_page": per_page}
+        resp = await self.get(url, params={**params, "page": start_page})
+        yield start_page, resp.json()
+
+        total_pages = int(resp.headers.get("X-WP-TotalPages", "1"))
+        if total_pages <= start_page:
+            return
+
+        semaphore = asyncio.Semaphore(max_concurrency or self.settings.page_concurrency)
+
+        async def fetch_page(page: int) -> tuple[int, list]:
+            async with semaphore:
+                return page, await self.get_json(url, params={**params, "page": page})
+
+        tasks = [
+            asyncio.create_task(fetch_page(page))
+            for page in range(start_page + 1, total_pages + 1)
+        ]
+        try:
+            for next_page in asyncio.as_completed(tasks):
+                yield await next_page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aclose(self) -> None:
+        # detached first, so concurrent requests open a new client meanwhile
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+woocommerce_client = WooCommerceClient()
+
+
+async def fetch_single(url: str, creator):
+    return creator(await woocommerce_client.get_json(url))
 
 
 def get_text(content, excerpt):
@@ -19,33 +302,29 @@ def get_text(content, excerpt):
     ).get_text()
 
 
-def fetch_list(
+async def fetch_numbered_pages(
+    url: str, per_page: int = 50, params: dict | None = None, start_page: int = 1
+) -> AsyncIterator[tuple[int, list]]:
+    async for number, page in woocommerce_client.iter_pages(
+        url, per_page=per_page, params=params, start_page=start_page
+    ):
+        logger.debug(f"Fetched {len(page)} items from {url} (page {number})")
+        yield number, page
+
+
+async def fetch_pages(
+    url: str, per_page: int = 50, params: dict | None = None
+) -> AsyncIterator[list]:
+    async for _, page in fetch_numbered_pages(url, per_page=per_page, params=params):
+        yield page
+
+
+async def fetch_list(
     url: str,
     per_page: int = 50,
+    params: dict | None = None,
 ) -> list:
-    settings = WoocommerceSettings()
-    page = 1
-    url = urljoin(settings.url, url)
-    params = {"per_page": per_page, "page": 1}
-    resp = requests.get(
-        url,
-        params=params,
-        auth=(settings.WOOCOMERCE_CLIENT_KEY, settings.WOOCOMERCE_SECRET_KEY),
-    )
-
-    resp.raise_for_status()
-    data = resp.json()
-    items = data
-    total_pages = int(resp.headers.get("X-WP-TotalPages", "1"))
-
-    if total_pages > 1:
-        for page in tqdm(range(2, total_pages + 1), desc="Fetching"):
-            params = {"per_page": per_page, "page": page}
-            resp = requests.get(
-                url,
-                params=params,
-                auth=(settings.WOOCOMERCE_CLIENT_KEY, settings.WOOCOMERCE_SECRET_KEY),
-            )
-            resp.raise_for_status()
-            items.extend(resp.json())
+    items = []
+    async for page in fetch_pages(url, per_page=per_page, params=params):
+        items.extend(page)
     return items
@@ -6,7 +6,9 @@ from sqlmodel import Column, Field, Relationship, SQLModel
 
 from src.turri_data_hub.embedding import EMBEDDING_DIM
 
+from ..model_utils import defer_columns
 from ..recommendation_system.taste_categories import TASTE_KEYS
+from ..vector_indexes import hnsw_index
 
 
 class ProductTagLink(SQLModel, table=True):
@@ -54,6 +56,12 @@ class Producer(SQLModel, table=True):
     )
     taste_embedding: list[float] = Field(sa_column=Column(Vector(len(TASTE_KEYS))))
 
+    __table_args__ = (
+        hnsw_index("producer", "embedding"),
+        hnsw_index("producer", "taste_embedding"),
+    )
+    __mapper_args__ = defer_columns("embedding")
+
 
 class Product(SQLModel, table=True):
     id: int = Field(primary_key=True, index=True)
@@ -89,6 +97,12 @@ class Product(SQLModel, table=True):
     price: float
     total_sales: int
 
+    __table_args__ = (
+        hnsw_index("product", "embedding"),
+        hnsw_index("product", "taste_embedding"),
+    )
+    __mapper_args__ = defer_columns("embedding")
+
     def customer_information(self):
         return self.model_dump(exclude=["link", "img_url", "products", "embedding"])
 
@@ -0,0 +1,408 @@
+"""
+Record/replay of the shop's REST API, to measure ingestion without `turri.cr`.
+
+    python -m src.turri_data_hub.woocommerce.replay record woocommerce_fixtures
+    python -m src.turri_data_hub.woocommerce.replay serve woocommerce_fixtures \\
+        --port 8081 --latency-ms 150 --scale products=10
+
+`record` lists every collection the sync reads and stores the raw responses,
+pagination headers included, as one JSON file per collection. The fixtures hold
+customer and order data, keep them out of git.
+
+`create_replay_app` serves the recorded records like the shop does: paginated
+with `X-WP-Total`/`X-WP-TotalPages`, filtered by `include`, `modified_after`,
+`parent` and `_fields`, ordered by `orderby`/`order`. Collections can be scaled
+up with synthetic copies whose ids and references are shifted by ID_STRIDE.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import math
+import random
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from .fetch.utils import woocommerce_client
+
+# The collections the sync reads
+COLLECTIONS = {
+    "tags": "/wp-json/wc/v3/products/tags",
+    "categories": "/wp-json/wc/v3/products/categories",
+    "products": "/wp-json/wc/v3/products",
+    "wp_products": "/wp-json/wp/v2/product",
+    "producers": "/wp-json/wp/v2/productor",
+    "media": "/wp-json/wp/v2/media",
+    "customers": "/wp-json/wc/v3/customers",
+    "orders": "/wp-json/wc/v3/orders",
+}
+COLLECTION_NAMES = {path: name for name, path in COLLECTIONS.items()}
+
+RECORDED_HEADERS = ("Content-Type", "Link", "X-WP-Total", "X-WP-TotalPages")
+
+# Copy n of a record gets the id `id + n * ID_STRIDE`
+ID_STRIDE = 10_000_000
+
+# The WordPress API rejects larger pages
+MAX_PER_PAGE = 100
+
+# Record fields the `orderby` values sort by, WooCommerce and WordPress names
+ORDERBY_FIELDS = {
+    "id": ("id",),
+    "include": ("id",),
+    "date": ("date_created_gmt", "date_gmt"),
+    "registered_date": ("date_created_gmt",),
+    "modified": ("date_modified_gmt", "modified_gmt"),
+}
+MODIFIED_FIELDS = ("date_modified_gmt", "modified_gmt")
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Passes requests on to `transport` and keeps the GET responses, see `save`.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.exchanges: list[dict] = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        if request.method == "GET":
+            await response.aread()
+            self.exchanges.append(
+                {
+                    "path": request.url.path.rstrip("/"),
+                    "params": dict(request.url.params),
+                    "status": response.status_code,
+                    "headers": {
+                        name: response.headers[name]
+                        for name in RECORDED_HEADERS
+                        if name in response.headers
+                    },
+                    "body": response.json() if response.content else None,
+                }
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    def save(self, out_dir: Path) -> dict[str, int]:
+        """
+        Writes the responses of each collection to `<name>.json`.
+
+        Returns:
+            dict: Number of responses per collection.
+        """
+        out_dir.mkdir(parents=True, exist_ok=True)
+        counts = {}
+        for name, path in COLLECTIONS.items():
+            responses = [e for e in self.exchanges if e["path"] == path]
+            (out_dir / f"{name}.json").write_text(
+                json.dumps({"path": path, "responses": responses})
+            )
+            counts[name] = len(responses)
+        return counts
+
+
+async def record_fixtures(out_dir: Path, per_page: int = MAX_PER_PAGE) -> dict:
+    """
+    Lists every collection of the shop completely, plus the image attachments of
+    the producers, and saves the responses to `out_dir`.
+    """
+    settings = woocommerce_client.settings
+    recorder = RecordingTransport(
+        httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_connections,
+            )
+        )
+    )
+    await woocommerce_client.use_transport(recorder)
+    try:
+        producers = []
+        for name, path in COLLECTIONS.items():
+            if name == "media":
+                continue
+            records = 0
+            async for _, page in woocommerce_client.iter_pages(
+                path, per_page=per_page, params={"orderby": "id", "order": "asc"}
+            ):
+                records += len(page)
+                if name == "producers":
+                    producers.extend(page)
+            logger.info(f"Recorded {records} {name}")
+
+        for data in producers:
+            for link in data.get("_links", {}).get("wp:attachment", []):
+                try:
+                    await woocommerce_client.get(link["href"])
+                except httpx.HTTPError as e:
+                    logger.debug(f"Could not record {link['href']}: {e}")
+    finally:
+        await woocommerce_client.use_transport(None)
+        await recorder.aclose()
+
+    counts = recorder.save(out_dir)
+    logger.success(f"Saved fixtures of {counts} responses to {out_dir}")
+    return counts
+
+
+def scaled_id(entity_id: Any, n: int) -> int:
+    return int(entity_id) + n * ID_STRIDE
+
+
+class FixtureStore:
+    """
+    The records of the recorded collections, with `scale[name]` copies of each
+    (1 is the recorded data only). Copies reference copies of the same number of
+    other collections where those exist, otherwise the recorded records.
+    """
+
+    def __init__(self, fixtures_dir: Path, scale: dict[str, int] | None = None):
+        self.scale = {name: 1 for name in COLLECTIONS} | (scale or {})
+        # the WordPress part of a product is cloned with the product
+        self.scale["wp_products"] = self.scale["products"]
+        unknown = set(self.scale) - set(COLLECTIONS)
+        if unknown:
+            raise ValueError(f"Unknown collections {unknown}")
+
+        self.records: dict[str, list[dict]] = {}
+        for name in COLLECTIONS:
+            file = fixtures_dir / f"{name}.json"
+            recorded = (
+                json.loads(file.read_text())["responses"] if file.exists() else []
+            )
+            by_id = {
+                record["id"]: record
+                for response in recorded
+                if response["status"] == 200 and isinstance(response["body"], list)
+                for record in response["body"]
+            }
+            self.records[name] = [
+                self._clone(name, record, n) if n else record
+                for n in range(self.scale[name])
+                for record in by_id.values()
+            ]
+
+    def _ref(self, name: str, entity_id: Any, n: int) -> int:
+        return scaled_id(entity_id, n) if n < self.scale[name] else int(entity_id)
+
+    def _clone(self, name: str, record: dict, n: int) -> dict:
+        record = copy.deepcopy(record)
+        record["id"] = scaled_id(record["id"], n)
+        if record.get("slug"):
+            record["slug"] = f"{record['slug']}-{n}"
+
+        if name == "products":
+            meta_box = record.get("meta_box", {})
+            producers = meta_box.get("producto-productor-relationship_from") or []
+            meta_box["producto-productor-relationship_from"] = [
+                str(self._ref("producers", producer_id, n)) for producer_id in producers
+            ]
+        elif name == "producers":
+            for link in record.get("_links", {}).get("wp:attachment", []):
+                link["href"] = re.sub(
+                    r"parent=\d+", f"parent={record['id']}", link["href"]
+                )
+        elif name == "orders":
+            # 0 marks a guest order
+            if record.get("customer_id"):
+                record["customer_id"] = self._ref("customers", record["customer_id"], n)
+            for item in record.get("line_items", []):
+                item["id"] = scaled_id(item["id"], n)
+                item["product_id"] = self._ref("products", item["product_id"], n)
+        return record
+
+    def count(self, name: str) -> int:
+        return len(self.records[name])
+
+    def query(self, name: str, params: dict[str, str]) -> list[dict]:
+        records = self.records[name]
+        if params.get("include"):
+            include = {int(i) for i in params["include"].split(",") if i}
+            records = [r for r in records if r["id"] in include]
+        if params.get("parent"):
+            # copies of a producer share the recorded attachments
+            parent = int(params["parent"]) % ID_STRIDE
+            records = [r for r in records if r.get("post") == parent]
+        if params.get("modified_after"):
+            after = _naive(params["modified_after"])
+            records = [r for r in records if _modified(r) and _modified(r) > after]
+
+        # like WordPress, newest first unless asked otherwise
+        fields = ORDERBY_FIELDS.get(params.get("orderby", "date"), ("id",))
+        return sorted(
+            records,
+            key=lambda r: next((r[f] for f in fields if r.get(f) is not None), ""),
+            reverse=params.get("order", "desc") == "desc",
+        )
+
+
+def _naive(value: str) -> datetime:
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+
+def _modified(record: dict) -> datetime | None:
+    value = next((record[f] for f in MODIFIED_FIELDS if record.get(f)), None)
+    return _naive(value) if value else None
+
+
+def _rebase_links(record: dict, base_url: str) -> dict:
+    """
+    Points the attachment links of a producer at the replay server instead of
+    the shop they were recorded from.
+    """
+    links = record.get("_links", {})
+    if "wp:attachment" not in links:
+        return record
+    attachments = [
+        {**link, "href": re.sub(r"^https?://[^/]+/", base_url, link["href"])}
+        for link in links["wp:attachment"]
+    ]
+    return {**record, "_links": {**links, "wp:attachment": attachments}}
+
+
+def _error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"code": code, "message": message, "data": {"status": status}},
+        status_code=status,
+    )
+
+
+def create_replay_app(
+    store: FixtureStore,
+    latency_ms: float = 0,
+    latency_jitter_ms: float = 0,
+    max_in_flight: int | None = None,
+) -> FastAPI:
+    """
+    ASGI stand-in for the shop serving `store`.
+
+    Every request waits `latency_ms` plus up to `latency_jitter_ms`. With
+    `max_in_flight`, requests beyond that many at a time get a 429 with
+    Retry-After, like a throttling host. Served records and requests are counted
+    in `app.state.stats`.
+    """
+    app = FastAPI(title="WooCommerce replay")
+    stats = {"requests": 0, "throttled": 0, "records": dict.fromkeys(COLLECTIONS, 0)}
+    app.state.stats = stats
+    app.state.store = store
+    in_flight = 0
+
+    @app.get("/{path:path}")
+    async def serve(path: str, request: Request):
+        nonlocal in_flight
+        stats["requests"] += 1
+        in_flight += 1
+        try:
+            if max_in_flight is not None and in_flight > max_in_flight:
+                stats["throttled"] += 1
+                response = _error(429, "too_many_requests", "Too many requests.")
+                response.headers["Retry-After"] = "1"
+                return response
+            if latency_ms or latency_jitter_ms:
+                await asyncio.sleep(
+                    (latency_ms + random.uniform(0, latency_jitter_ms)) / 1000
+                )
+            return _list_response(store, path, request, stats)
+        finally:
+            in_flight -= 1
+
+    return app
+
+
+def _list_response(
+    store: FixtureStore, path: str, request: Request, stats: dict
+) -> JSONResponse:
+    name = COLLECTION_NAMES.get("/" + path.strip("/"))
+    if name is None:
+        return _error(
+            404,
+            "rest_no_route",
+            "No route was found matching the URL and request method.",
+        )
+
+    params = dict(request.query_params)
+    try:
+        page = int(params.get("page", 1))
+        per_page = int(params.get("per_page", 10))
+    except ValueError:
+        return _error(400, "rest_invalid_param", "Invalid parameter(s): page")
+    if not 1 <= per_page <= MAX_PER_PAGE:
+        return _error(400, "rest_invalid_param", "Invalid parameter(s): per_page")
+
+    records = store.query(name, params)
+    total_pages = max(1, math.ceil(len(records) / per_page))
+    if page > total_pages:
+        return _error(
+            400,
+            "rest_post_invalid_page_number",
+            "The page number requested is larger than the number of pages available.",
+        )
+
+    body = records[(page - 1) * per_page : page * per_page]
+    if params.get("_fields"):
+        fields = params["_fields"].split(",")
+        body = [{f: r[f] for f in fields if f in r} for r in body]
+    if name == "producers":
+        body = [_rebase_links(record, str(request.base_url)) for record in body]
+    stats["records"][name] += len(body)
+    return JSONResponse(
+        body,
+        headers={"X-WP-Total": str(len(records)), "X-WP-TotalPages": str(total_pages)},
+    )
+
+
+def parse_scale(values: list[str]) -> dict[str, int]:
+    """
+    Parses `name=factor` arguments, e.g. ["products=10"].
+    """
+    scale = {}
+    for value in values:
+        name, _, factor = value.partition("=")
+        scale[name] = int(factor)
+    return scale
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="Record the shop's responses")
+    record.add_argument("fixtures", type=Path)
+    serve = commands.add_parser("serve", help="Replay recorded responses over HTTP")
+    serve.add_argument("fixtures", type=Path)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--latency-ms", type=float, default=0)
+    serve.add_argument("--latency-jitter-ms", type=float, default=0)
+    serve.add_argument("--max-in-flight", type=int, default=None)
+    serve.add_argument("--scale", action="append", default=[], metavar="NAME=N")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record_fixtures(args.fixtures))
+    else:
+        import uvicorn
+
+        app = create_replay_app(
+            FixtureStore(args.fixtures, parse_scale(args.scale)),
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            max_in_flight=args.max_in_flight,
+        )
+        uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.turri_data_hub.db import TurriDB
+from src.turri_data_hub.settings import database_settings
+
+# Rows written by the tests use ids from here on and are deleted afterwards
+TEST_ID_BASE = 2_000_000_000
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def db() -> TurriDB:
+    """
+    The configured database, point POSTGRES_* at a scratch database. Index scans
+    are disabled so nearest neighbour queries are exact.
+    """
+    db = TurriDB()
+    db.engine = create_async_engine(
+        database_settings.get_postgres_dsn(driver_name="asyncpg"),
+        connect_args={"server_settings": {"enable_indexscan": "off"}},
+    )
+    db.session_maker = async_sessionmaker(db.engine, expire_on_commit=False)
+    try:
+        await db.initialize_db()
+    except (OSError, DBAPIError) as e:
+        pytest.skip(f"Database not reachable: {e}")
+    yield db
+    await db.engine.dispose()
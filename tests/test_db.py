@@ -0,0 +1,114 @@
+from datetime import datetime
+
+import pytest
+
+from src.turri_data_hub.db import _collect_upsert_rows
+from src.turri_data_hub.recommendation_system.taste_categories import TASTE_KEYS
+from src.turri_data_hub.woocommerce.models import (
+    Producer,
+    Product,
+    ProductTag,
+    ProductTagLink,
+)
+
+from .conftest import TEST_ID_BASE
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 1, 1)
+
+
+def make_tag(offset: int, name: str = "tag") -> ProductTag:
+    return ProductTag(id=TEST_ID_BASE + offset, description="", name=name, slug=name)
+
+
+def make_producer() -> Producer:
+    return Producer(
+        id=TEST_ID_BASE,
+        link="",
+        title="producer",
+        content="",
+        excerpt="",
+        slug="producer",
+        taste_embedding=[0.0] * len(TASTE_KEYS),
+    )
+
+
+def make_product(tags: list[ProductTag], title: str = "product") -> Product:
+    return Product(
+        id=TEST_ID_BASE,
+        link="",
+        title=title,
+        content="",
+        slug="product",
+        excerpt="",
+        description="",
+        producer_id=TEST_ID_BASE,
+        taste_embedding=[0.0] * len(TASTE_KEYS),
+        date_created=NOW,
+        date_modified=NOW,
+        type="simple",
+        status="publish",
+        catalog_visibility="visible",
+        featured=False,
+        price=1,
+        total_sales=0,
+        tags=tags,
+        categories=[],
+    )
+
+
+@pytest.fixture
+async def clean_db(db):
+    yield db
+    for model in (ProductTagLink, Product, Producer, ProductTag):
+        column = model.product_id if model is ProductTagLink else model.id
+        await db.delete_where(model, [column >= TEST_ID_BASE])
+
+
+async def test_upsert_all_inserts_then_updates(clean_db):
+    tags = [make_tag(i, f"tag-{i}") for i in range(3)]
+
+    assert await clean_db.upsert_all(tags) == (3, 0)
+    tags[0].name = "renamed"
+    assert await clean_db.upsert_all(tags) == (0, 3)
+
+    stored = await clean_db.query_table(
+        ProductTag, where_clauses=[ProductTag.id == TEST_ID_BASE], mode="first"
+    )
+    assert stored.name == "renamed"
+
+
+async def test_upsert_all_replaces_link_rows(clean_db):
+    tags = [make_tag(i, f"tag-{i}") for i in range(3)]
+    await clean_db.upsert_all(tags)
+    await clean_db.upsert_all([make_producer()])
+
+    await clean_db.upsert_all([make_product(tags[:2])])
+    await clean_db.upsert_all([make_product(tags[1:], title="moved")])
+
+    links = await clean_db.query_table(
+        ProductTagLink, where_clauses=[ProductTagLink.product_id == TEST_ID_BASE]
+    )
+    assert sorted(link.tag_id for link in links) == [
+        TEST_ID_BASE + 1,
+        TEST_ID_BASE + 2,
+    ]
+
+
+async def test_upsert_all_collapses_duplicates_onto_the_last(clean_db):
+    first, last = make_tag(0, "first"), make_tag(0, "last")
+
+    assert await clean_db.upsert_all([first, last]) == (1, 0)
+    stored = await clean_db.query_table(
+        ProductTag, where_clauses=[ProductTag.id == TEST_ID_BASE], mode="first"
+    )
+    assert stored.name == "last"
+
+
+def test_link_rows_need_the_parent_key():
+    product = make_product([make_tag(0)])
+    product.id = None
+
+    with pytest.raises(ValueError):
+        _collect_upsert_rows([product])
@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+
+from src.turri_data_hub.embedding import EMBEDDING_DIM
+from src.turri_data_hub.recommendation_system import get_recommendations
+from src.turri_data_hub.recommendation_system.get_recommendations import (
+    CATEGORIES_FACTOR,
+    EMBEDDINGS_FACTOR,
+    MISSING_DISTANCE,
+    get_top_k_producers,
+)
+from src.turri_data_hub.recommendation_system.models import UserBehavior
+from src.turri_data_hub.recommendation_system.recommendation_index import (
+    RecommendationIndex,
+    _to_matrix,
+    hybrid_top_k_batch,
+)
+from src.turri_data_hub.recommendation_system.taste_categories import TASTE_KEYS
+from src.turri_data_hub.woocommerce.models import Producer
+
+from .conftest import TEST_ID_BASE
+
+
+def reference_top_k(ids, taste, emb, user_taste, user_emb, k):
+    """
+    The SQL query of `get_recommendations` spelled out row by row.
+    """
+
+    def candidates(vectors, query):
+        distances = {
+            pid: None if v is None else float(np.linalg.norm(np.subtract(v, query)))
+            for pid, v in zip(ids, vectors)
+        }
+        nearest = sorted(
+            ids, key=lambda pid: (distances[pid] is None, distances[pid] or 0, pid)
+        )[: k * 3]
+        # coalesce(distance, MISSING_DISTANCE)
+        return {
+            pid: MISSING_DISTANCE if distances[pid] is None else distances[pid]
+            for pid in nearest
+        }
+
+    in_taste = candidates(taste, user_taste)
+    in_emb = candidates(emb, user_emb)
+    scores = {
+        pid: CATEGORIES_FACTOR * in_taste.get(pid, MISSING_DISTANCE)
+        + EMBEDDINGS_FACTOR * in_emb.get(pid, MISSING_DISTANCE)
+        for pid in in_taste.keys() | in_emb.keys()
+    }
+    return sorted(scores, key=lambda pid: (scores[pid], pid))[:k]
+
+
+def random_vectors(rng, n, dim, missing=0.2):
+    # few distinct values, so distances tie a lot
+    return [
+        None if rng.random() < missing else rng.integers(0, 3, dim).tolist()
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_the_sql_scoring(seed):
+    rng = np.random.default_rng(seed)
+    ids = np.sort(rng.choice(1000, size=int(rng.integers(1, 40)), replace=False))
+    taste = random_vectors(rng, len(ids), 4)
+    emb = random_vectors(rng, len(ids), 6)
+    user_taste = rng.integers(0, 3, (3, 4)).astype(float)
+    user_emb = rng.integers(0, 3, (3, 6)).astype(float)
+    k = int(rng.integers(1, 6))
+
+    results = hybrid_top_k_batch(
+        ids,
+        _to_matrix(taste, 4),
+        _to_matrix(emb, 6),
+        user_taste,
+        user_emb,
+        k,
+        CATEGORIES_FACTOR,
+        EMBEDDINGS_FACTOR,
+        MISSING_DISTANCE,
+    )
+
+    for row, result in enumerate(results):
+        expected = reference_top_k(
+            ids.tolist(), taste, emb, user_taste[row], user_emb[row], k
+        )
+        assert result == expected
+
+
+def test_near_identical_vectors_keep_their_order():
+    vector = np.random.default_rng(0).normal(size=EMBEDDING_DIM) * 10
+    ids = np.array([1, 2])
+    taste = _to_matrix([(vector + 1e-6).tolist(), (vector + 1e-3).tolist()])
+    emb = _to_matrix([vector.tolist(), vector.tolist()])
+
+    result = hybrid_top_k_batch(
+        ids, taste, emb, vector[None], vector[None], 2, 4, 1, MISSING_DISTANCE
+    )
+
+    assert result == [[1, 2]]
+
+
+@pytest.fixture
+async def producers(db):
+    rng = np.random.default_rng(1)
+    shared_taste = rng.random(len(TASTE_KEYS)).tolist()
+    shared_emb = rng.random(EMBEDDING_DIM).tolist()
+    rows = []
+    for i in range(16):
+        tied = i < 5
+        rows.append(
+            Producer(
+                id=TEST_ID_BASE + i,
+                link="",
+                title=f"producer {i}",
+                content="",
+                excerpt="",
+                slug=f"producer-{i}",
+                taste_embedding=(
+                    shared_taste if tied else rng.random(len(TASTE_KEYS)).tolist()
+                ),
+                embedding=(
+                    None
+                    if i in (5, 6)
+                    else shared_emb
+                    if tied
+                    else rng.random(EMBEDDING_DIM).tolist()
+                ),
+            )
+        )
+    await db.upsert_all(rows)
+    yield rows
+    await db.delete_where(Producer, [Producer.id >= TEST_ID_BASE])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("k", [1, 3, 8])
+async def test_index_matches_get_recommendations(db, producers, monkeypatch, k):
+    monkeypatch.setattr(get_recommendations.recommendation_index, "_vectors", {})
+    index = RecommendationIndex()
+    await index.load(db)
+
+    rng = np.random.default_rng(k)
+    tied = producers[0]
+    users = [
+        UserBehavior(
+            user_id=0,
+            description="",
+            taste_embedding=tied.taste_embedding,
+            embedding=tied.embedding,
+        )
+    ] + [
+        UserBehavior(
+            user_id=i,
+            description="",
+            taste_embedding=rng.random(len(TASTE_KEYS)).tolist(),
+            embedding=rng.random(EMBEDDING_DIM).tolist(),
+        )
+        for i in range(1, 6)
+    ]
+
+    for user in users:
+        from_sql = [p.id for p in await get_top_k_producers(db, user, k)]
+        from_index = index.top_k_ids(
+            Producer, user, k, CATEGORIES_FACTOR, EMBEDDINGS_FACTOR, MISSING_DISTANCE
+        )
+        assert from_index == from_sql
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from src.turri_data_hub.update.sync_state import Watermark
+
+T0 = datetime(2026, 1, 1)
+
+
+def test_advances_to_the_newest_saved_record():
+    watermark = Watermark(since=T0)
+    watermark.ok(T0 + timedelta(days=2), 1)
+    watermark.ok(T0 + timedelta(days=1), 2)
+
+    assert watermark.value == T0 + timedelta(days=2)
+    assert watermark.succeeded == {1, 2}
+
+
+def test_failed_record_holds_the_watermark_back():
+    watermark = Watermark(since=T0)
+    watermark.ok(T0 + timedelta(days=3), 1)
+    watermark.failed(T0 + timedelta(days=2), 2, "boom")
+
+    assert watermark.value == T0 + timedelta(days=2) - timedelta(seconds=1)
+    assert watermark.failures == {2: "boom"}
+
+
+def test_never_moves_before_the_previous_run_without_failures():
+    watermark = Watermark(since=T0)
+
+    assert watermark.value == T0
+
+
+def test_later_success_clears_the_failure():
+    watermark = Watermark()
+    watermark.failed(T0, 1, "boom")
+    watermark.ok(T0, 1)
+
+    assert watermark.failures == {}
+    assert watermark.succeeded == {1}
+
+
+def test_failure_without_date_does_not_clamp():
+    watermark = Watermark(since=T0)
+    watermark.failed(None, 1, "boom")
+
+    assert watermark.value == T0
+    assert 1 in watermark.failures
+
+
+def test_dead_lettered_record_stops_pinning_the_watermark():
+    watermark = Watermark(since=T0, attempts={1: 2, 2: 1}, max_attempts=3)
+    watermark.ok(T0 + timedelta(days=2), 3)
+    watermark.failed(T0 + timedelta(days=1), 1, "boom")
+
+    assert watermark.is_dead_letter(1)
+    assert watermark.value == T0 + timedelta(days=2)
+    # still recorded, so its failure row counts the attempt
+    assert watermark.failures == {1: "boom"}
+
+    watermark.failed(T0 + timedelta(days=1), 2, "boom")
+    assert not watermark.is_dead_letter(2)
+    assert watermark.value == T0 + timedelta(days=1) - timedelta(seconds=1)
+
+
+def test_resume_page_is_the_first_page_not_done():
+    watermark = Watermark(start_page=3)
+    for page in (3, 4, 6):
+        watermark.page_done(page)
+
+    assert watermark.resume_page == 5
@@ -0,0 +1,62 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+
+import pytest
+
+from src.turri_data_hub.update import webhooks
+from src.turri_data_hub.update.models import SyncFailure
+from src.turri_data_hub.update.webhooks import WebhookQueue, verify_signature
+
+from .conftest import TEST_ID_BASE
+
+SECRET = "webhook-secret"
+BODY = b'{"id": 1, "status": "processing"}'
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return base64.b64encode(
+        hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    ).decode()
+
+
+def test_accepts_the_shops_signature():
+    assert verify_signature(BODY, sign(BODY), SECRET)
+
+
+def test_rejects_a_missing_signature():
+    assert not verify_signature(BODY, None, SECRET)
+    assert not verify_signature(BODY, "", SECRET)
+
+
+def test_rejects_another_secret():
+    assert not verify_signature(BODY, sign(BODY, "other"), SECRET)
+
+
+def test_rejects_a_changed_body():
+    assert not verify_signature(BODY + b" ", sign(BODY), SECRET)
+
+
+@pytest.mark.anyio
+async def test_failed_deliveries_are_recorded_for_the_next_sync(db, monkeypatch):
+    async def fail(db, data):
+        raise ValueError("boom")
+
+    monkeypatch.setitem(webhooks.WEBHOOK_HANDLERS, ("order", "updated"), fail)
+    queue = WebhookQueue(maxsize=10)
+    queue.start(db)
+    try:
+        for _ in range(2):
+            queue.enqueue(("order", "updated"), {"id": TEST_ID_BASE})
+            await asyncio.wait_for(queue._queue.join(), 10)
+        failures = await db.query_table(
+            SyncFailure, where_clauses=[SyncFailure.entity_id == TEST_ID_BASE]
+        )
+    finally:
+        await queue.stop(timeout_s=1)
+        await db.delete_where(SyncFailure, [SyncFailure.entity_id == TEST_ID_BASE])
+
+    assert queue.failed == 2
+    assert [(f.resource, f.attempts) for f in failures] == [("orders", 2)]
+    assert "boom" in failures[0].error